@@ -47,9 +47,12 @@ except:
 # Upload the data to the cloud storage
 
 
+# The table is rebuilt from scratch, so its files and the incremental ingest state are reset. 
+# The data file is only copied if it isn't in the cloud storage yet.
+
 !hdfs dfs -rm -r $STORAGE/data/warehouse/tablespace/external/hive/cc_data
+!rm -f /home/cdsw/data/ingest_state.json
 !hdfs dfs -mkdir -p $STORAGE/datalake
 !hdfs dfs -mkdir -p $STORAGE/datalake/data
 !hdfs dfs -mkdir -p $STORAGE/datalake/data/anomalydetection
-!hdfs dfs -rm $STORAGE/datalake/data/anomalydetection/creditcard.csv
-!hdfs dfs -copyFromLocal /home/cdsw/data/creditcard.csv $STORAGE/datalake/data/anomalydetection/creditcard.csv
\ No newline at end of file
+!hdfs dfs -test -e $STORAGE/datalake/data/anomalydetection/creditcard.csv || hdfs dfs -copyFromLocal /home/cdsw/data/creditcard.csv $STORAGE/datalake/data/anomalydetection/creditcard.csv
\ No newline at end of file
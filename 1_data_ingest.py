@@ -84,16 +84,153 @@ spark = SparkSession\
 #
     
 #### Now we can read in the data from Cloud Storage into Spark...
+# The schema is declared up front rather than inferred, which saves Spark a full pass over the 
+# file. The 28 PCA features are read as 32-bit floats, the precision the model is trained and 
+# served in, which halves their size on disk and in memory.
+# Each row is stamped with an `INGEST_DATE` (today, or the `INGEST_DATE` environment variable 
+# as `YYYY-MM-DD`). The data has no transaction time, so this date serves as the table's time 
+# bucket.
+
+import time
+from datetime import date
+from pyspark.sql import functions as F
+from fraud.ingest import load_state, save_state, pending_files, changed_files, record_files
 
 storage = os.environ['STORAGE']
 
+cc_schema = StructType(
+  [StructField("ACCOUNT_ID", LongType(), True)] +
+  [StructField("V{}".format(i), FloatType(), True) for i in range(1, 29)] +
+  [StructField("CLASS", IntegerType(), True)]
+)
+
+# The table is partitioned by `CLASS` and `INGEST_DATE`. Queries for the fraud cases only read 
+# the small `CLASS=1` partition, and queries for recent data skip the older dates. Nearly all 
+# rows are `CLASS=0`, so shuffling on the partition columns alone would leave one task to write 
+# almost the whole table. The shuffle also hashes `ACCOUNT_ID` into `INGEST_FILES_PER_PARTITION` 
+# buckets (default 8), so each partition is written by up to that many tasks. Each account 
+# still lands in a single file, sorted by `ACCOUNT_ID` within it, and `INGEST_MAX_ROWS_PER_FILE` 
+# (default 5,000,000) caps the file size when a few accounts dominate.
+# The Parquet files use `INGEST_COMPRESSION` (default snappy, which is fast to decompress) 
+# and `INGEST_ROW_GROUP_MB` row groups (default 128), so scans make large sequential reads.
+# Partition columns come after the data columns, so `CLASS` is no longer the last column: 
+# read the feature columns by name.
+
+files_per_partition = int(os.getenv("INGEST_FILES_PER_PARTITION", "8"))
+
+def write_cc_data(df, mode):
+  df\
+    .repartition("CLASS", "INGEST_DATE", F.pmod(F.hash("ACCOUNT_ID"), F.lit(files_per_partition)))\
+    .sortWithinPartitions("ACCOUNT_ID")\
+    .write.format("parquet")\
+    .mode(mode)\
+    .partitionBy("CLASS", "INGEST_DATE")\
+    .option("maxRecordsPerFile", int(os.getenv("INGEST_MAX_ROWS_PER_FILE", "5000000")))\
+    .option("compression", os.getenv("INGEST_COMPRESSION", "snappy"))\
+    .option("parquet.block.size", int(os.getenv("INGEST_ROW_GROUP_MB", "128")) * 1024 * 1024)\
+    .saveAsTable('default.cc_data')
+
+#### Incremental ingest
+# `INGEST_SOURCE` is the input file, or a glob such as `/home/cdsw/data/drops/*.csv` for 
+# regular data drops. The default `INGEST_MODE=full` rebuilds the table from every matching file. 
+# `INGEST_MODE=incremental` appends only the files that are new since the last run, as new 
+# partitions, and stops early when there are none. The files already loaded are recorded, 
+# with their size and modification time, in `INGEST_STATE`. The data has no transaction time 
+# to keep a row-level watermark on, so the watermark is kept per file. Drops are expected 
+# never to change: a loaded file that has changed since is skipped with a warning, because 
+# appending it again would duplicate its rows. Use `INGEST_MODE=full` to reload it.
+
+ingest_mode = os.getenv("INGEST_MODE", "full")
+ingest_source = os.getenv("INGEST_SOURCE", "/home/cdsw/data/creditcard.csv")
+ingest_state_path = os.getenv("INGEST_STATE", "/home/cdsw/data/ingest_state.json")
+
+def list_source_files(pattern):
+  path = spark._jvm.org.apache.hadoop.fs.Path(pattern)
+  statuses = path.getFileSystem(spark._jsc.hadoopConfiguration()).globStatus(path) or []
+  return [(s.getPath().toString(), s.getLen(), s.getModificationTime()) for s in statuses if s.isFile()]
+
+def table_size(table):
+  if table.split(".")[1] not in [t.name for t in spark.catalog.listTables(table.split(".")[0])]:
+    return 0, 0, None
+  location = spark.sql("describe formatted " + table)\
+    .filter("col_name = 'Location'").collect()[0].data_type
+  path = spark._jvm.org.apache.hadoop.fs.Path(location)
+  size = path.getFileSystem(spark._jsc.hadoopConfiguration()).getContentSummary(path).getLength()
+  return spark.table(table).count(), size, location
+
+#### Streaming ingest
+# `INGEST_MODE=stream` keeps this session running and watches `INGEST_LANDING` (default 
+# `/home/cdsw/data/landing`, standing in for the NiFi output directory) for new `.csv` and `.json` 
+# transaction files. Spark Structured Streaming appends them to the table in micro-batches, 
+# every `INGEST_TRIGGER_SECONDS` (default 60). `INGEST_MAX_FILES_PER_TRIGGER` caps the files 
+# per micro-batch, and `INGEST_TRIGGER_ONCE=1` processes whatever has landed and stops, for 
+# use as a scheduled Job. Which files have been processed is kept in the checkpoint directory 
+# `INGEST_CHECKPOINT`, so a restarted stream carries on where it stopped. Each micro-batch 
+# reports its rows, time and rows/sec. The CSV and JSON streams take turns to write, so 
+# their appends to the table never overlap.
+
+import threading
+write_lock = threading.Lock()
+
+def write_micro_batch(batch_df, batch_id):
+  start = time.time()
+  batch_df.persist()
+  rows = batch_df.count()
+  if rows:
+    with write_lock:
+      write_cc_data(batch_df, "append")
+  batch_df.unpersist()
+  seconds = time.time() - start
+  print("Batch {}: {} rows in {:.1f}s ({:.0f} rows/sec)".format(
+    batch_id, rows, seconds, rows / seconds if seconds else 0.0))
+
+if ingest_mode == "stream":
+  landing = os.getenv("INGEST_LANDING", "/home/cdsw/data/landing")
+  checkpoint = os.getenv("INGEST_CHECKPOINT", "/home/cdsw/data/ingest_checkpoint")
+  max_files = os.getenv("INGEST_MAX_FILES_PER_TRIGGER")
+  trigger = {"once": True} if os.getenv("INGEST_TRIGGER_ONCE", "0") == "1" \
+    else {"processingTime": "{} seconds".format(os.getenv("INGEST_TRIGGER_SECONDS", "60"))}
+  for fmt in ["csv", "json"]:
+    reader = spark.readStream.schema(cc_schema)
+    if max_files:
+      reader = reader.option("maxFilesPerTrigger", int(max_files))
+    if fmt == "csv":
+      reader = reader.option("header", True).option("nullValue", "NA")
+    reader.format(fmt).load(os.path.join(landing, "*." + fmt))\
+      .withColumn("INGEST_DATE", F.current_date())\
+      .writeStream\
+      .queryName("cc_data_" + fmt)\
+      .foreachBatch(write_micro_batch)\
+      .option("checkpointLocation", os.path.join(checkpoint, fmt))\
+      .trigger(**trigger)\
+      .start()
+  print("Streaming {} into default.cc_data".format(landing))
+  for query in spark.streams.active:
+    query.awaitTermination()
+  print("Streaming ingest stopped")
+  sys.exit(0)
+
+source_files = list_source_files(ingest_source)
+ingest_state = load_state(ingest_state_path) if ingest_mode == "incremental" else {}
+new_files = pending_files(source_files, ingest_state)
+for path in changed_files(source_files, ingest_state):
+  print("WARNING: {} changed after it was ingested, skipping it. Run a full ingest to reload it.".format(path))
+print("{} source files, {} to ingest".format(len(source_files), len(new_files)))
+if not new_files:
+  print("Nothing new to ingest")
+  sys.exit(0)
+
+ingest_date = os.getenv("INGEST_DATE", date.today().isoformat())
+ingest_start = time.time()
+rows_before, bytes_before, _ = table_size("default.cc_data") if ingest_mode == "incremental" else (0, 0, None)
+
 cc_data = spark.read.csv(
-  "/home/cdsw/data/creditcard.csv".format(storage),
+  new_files,
   header=True,
-  inferSchema=True,
+  schema=cc_schema,
   sep=',',
   nullValue='NA'
-)
+).withColumn("INGEST_DATE", F.lit(ingest_date).cast("date"))
 
 #### ...and inspect the data.
 
@@ -108,21 +245,27 @@ spark.sql("show databases").show()
 
 spark.sql("show tables in default").show()
 
-spark.sql("truncate table default.cc_data")
+if ingest_mode != "incremental":
+  spark.sql("truncate table default.cc_data")
 
-spark.sql("drop table if exists default.cc_data")
+  spark.sql("drop table if exists default.cc_data")
 
 ### Create the Hive table
 # This is here to create the table in Hive used be the other parts of the project, if it
 # does not already exist.
 
 print("creating the cc_data database")
-cc_data\
-  .write.format("parquet")\
-  .mode("overwrite")\
-  .saveAsTable(
-    'default.cc_data'
-)
+write_cc_data(cc_data, "append" if ingest_mode == "incremental" else "overwrite")
+
+# Record the ingested files, then report the ingest throughput and the bytes written.
+save_state(ingest_state_path, record_files(ingest_state, source_files, new_files))
+
+ingest_seconds = time.time() - ingest_start
+rows_after, bytes_after, table_location = table_size("default.cc_data")
+ingest_rows = rows_after - rows_before
+print("Ingested {} rows from {} files in {:.1f}s ({:.0f} rows/sec), {:.1f} MB written to {}".format(
+  ingest_rows, len(new_files), ingest_seconds, ingest_rows / ingest_seconds,
+  (bytes_after - bytes_before) / 1e6, table_location))
 
 # Show the data in the hive table
 spark.sql("select * from default.cc_data").show()
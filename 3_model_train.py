@@ -81,70 +81,122 @@
 #    
 
 from datetime import datetime
+import os
+import sys
 import cdsw
 import numpy as np
 import pandas as pd
 import torch
-import torch.nn as nn
-import torch.nn.functional as F
-from torch.utils.data import TensorDataset, DataLoader
+from fraud.training import train_autoencoder, EarlyStopping, scaler_drift
+from fraud.threshold import best_split_point, split_point_at_fpr, operating_point
 from pyspark.sql import SparkSession
 
-# load the data
-
-spark = SparkSession\
-    .builder\
-    .appName("PythonSQL")\
-    .master("local[*]")\
-    .getOrCreate()
-
-try:
-    spark_df = spark.sql("SELECT * FROM default.cc_data")
-    spark_df.printSchema()
-    data = spark_df.toPandas()
-except:
-    data = pd.read_csv("/home/cdsw/data/creditcard.csv")
-
-feature_names=data.columns.values[:-1]
-train_test_set = data[data.CLASS==0][feature_names]
-
-# split into train set and test set
-
-from sklearn.model_selection import train_test_split
-train_set, test_set = train_test_split(train_test_set, test_size=0.2, random_state=42)
+### Warm start
+# Set `TRAIN_WARM_START=1` to fine-tune the current `model/creditcard-fraud.model` instead of 
+# training from scratch. `TRAIN_NEW_ROWS` is a SQL condition on `cc_data` that selects the newly 
+# ingested rows, e.g. `INGEST_DATE >= '2021-06-01'`. Only those rows (plus the fraud cases, for the split point) are read, and 
+# training runs for `TRAIN_WARM_EPOCHS` epochs (default 5).
+# The saved scaler is kept unless the new rows fall outside its fitted range by more than 
+# `TRAIN_SCALER_DRIFT` (default 0.05, as a fraction of each feature's range). In that case its 
+# range is widened to cover the new rows too.
+# A warm start requires `TRAIN_NEW_ROWS`. The sweep trains every trial from scratch, so it 
+# can't be combined with a warm start.
+
+warm_start = os.getenv('TRAIN_WARM_START', '0') == '1'
+new_rows = os.getenv('TRAIN_NEW_ROWS') if warm_start else None
+if warm_start and not new_rows:
+    sys.exit("TRAIN_WARM_START needs TRAIN_NEW_ROWS to select the rows to fine-tune on")
+if warm_start and os.getenv('TRAIN_SWEEP'):
+    sys.exit("TRAIN_WARM_START can't be combined with TRAIN_SWEEP")
+
+### Streaming input
+# By default the whole table is read into pandas through Spark. With `TRAIN_INPUT=parquet` the 
+# Parquet files behind `cc_data` are read directly, one record batch at a time and only the 
+# feature and label columns, as float32. The scaler is fitted in one pass, and every epoch 
+# streams the training rows again, so memory stays flat as the table grows. Up to 
+# `TRAIN_HOLDOUT_ROWS` (default 100000) held-out normal rows are kept for validation and the 
+# split point. `TRAIN_PARQUET_PATH` overrides the table location. This mode does not support the 
+# warm start or the sweep.
+
+streaming = os.getenv('TRAIN_INPUT', 'spark') == 'parquet'
+if streaming and (warm_start or os.getenv('TRAIN_SWEEP')):
+    sys.exit("TRAIN_INPUT=parquet can't be combined with TRAIN_WARM_START or TRAIN_SWEEP")
 
 from sklearn.preprocessing import MinMaxScaler
-scaler=MinMaxScaler().fit(train_set)
-train_set=scaler.transform(train_set)
-test_set=scaler.transform(test_set)
-
-#save the scaler to use with the deployed model.
 import joblib 
-joblib.dump(scaler, 'model/cc_scaler.pkl') 
-
-class autoencoder(nn.Module):
-    def __init__(self,num_input):
-        super(autoencoder, self).__init__()
-        self.encoder = nn.Sequential(
-            nn.Linear(num_input, 15),
-            nn.ReLU(True),
-            nn.Linear(15, 7))
-        self.decoder = nn.Sequential(
-            nn.Linear(7, 15),
-            nn.ReLU(True),
-            nn.Linear(15, num_input),
-            nn.Tanh())
-
-    def forward(self, x):
-        x = self.encoder(x)
-        x = self.decoder(x)
-        return x
 
+# The model's inputs, in the order 99_model.py expects them. `cc_data` is partitioned by 
+# `CLASS` and `INGEST_DATE`, which come after these columns.
+feature_names = np.array(['ACCOUNT_ID'] + ['V{}'.format(i) for i in range(1, 29)])
+
+if streaming:
+    from fraud.parquet_input import ParquetRows, default_table_path
+    train_set = ParquetRows(
+        os.getenv('TRAIN_PARQUET_PATH', default_table_path()), feature_names,
+        max_holdout=int(os.getenv('TRAIN_HOLDOUT_ROWS', '100000'))).fit()
+    scaler = train_set.scaler
+    test_set = scaler.transform(train_set.holdout_rows)
+    fraud_rows = train_set.fraud_rows
+    print('Streaming {} training rows, {} held out, {} fraud'.format(
+          train_set.shape[0], len(test_set), len(fraud_rows)))
+else:
+    # load the data
+    # The table is read from its local memory-mapped cache (`fraud/data_cache.py`) when the 
+    # Parquet files behind it are reachable, which avoids starting Spark. The cache refreshes 
+    # whenever those files change. Set `CC_DATA_CACHE=0` to always query Hive through Spark.
+    # A warm start's `TRAIN_NEW_ROWS` is SQL, so it always goes through Spark.
+
+    data = None
+    if os.getenv('CC_DATA_CACHE', '1') == '1' and not new_rows:
+        from fraud.data_cache import load_cc_data, CacheUnavailable
+        try:
+            data = load_cc_data()
+        except CacheUnavailable as e:
+            print('cc_data cache unavailable ({}), reading through Spark'.format(e))
+
+    if data is None:
+        spark = SparkSession\
+            .builder\
+            .appName("PythonSQL")\
+            .master("local[*]")\
+            .getOrCreate()
+
+        try:
+            spark_df = spark.sql("SELECT * FROM default.cc_data" + 
+                                 (" WHERE CLASS = 1 OR ({})".format(new_rows) if new_rows else ""))
+            spark_df.printSchema()
+            data = spark_df.toPandas()
+        except:
+            data = pd.read_csv("/home/cdsw/data/creditcard.csv")
+            if new_rows:
+                data = data[(data.CLASS==1) | data.eval(new_rows)]
+
+    train_test_set = data[data.CLASS==0][feature_names]
+    fraud_rows = data[data.CLASS==1][feature_names].values
+
+    # split into train set and test set
+
+    from sklearn.model_selection import train_test_split
+    train_set, test_set = train_test_split(train_test_set, test_size=0.2, random_state=42)
+
+    if warm_start:
+        scaler=joblib.load('model/cc_scaler.pkl')
+        drift=scaler_drift(scaler, train_set)
+        print('Scaler drift on the new rows: {:.4f}'.format(drift))
+        if drift > float(os.getenv('TRAIN_SCALER_DRIFT', '0.05')):
+            print('Widening the scaler range to cover the new rows')
+            scaler.partial_fit(train_set)
+    else:
+        scaler=MinMaxScaler().fit(train_set)
+    train_set=scaler.transform(train_set)
+    test_set=scaler.transform(test_set)
 
+#save the scaler to use with the deployed model.
+joblib.dump(scaler, 'model/cc_scaler.pkl') 
 
 ### Experiments options
-# If you are running this as an experiment, pass the cv, solver and max_iter values
-# as arguments in that order. e.g. `5 lbfgs 100`.
+# If you are running this as an experiment, pass the batch_size, lr and num_epochs values
+# as arguments in that order. e.g. `256 0.01 100`.
 
 if len (sys.argv) == 4:
   try:
@@ -157,58 +209,80 @@ else:
     batch_size = 256
     lr = 0.01 
     num_epochs = 100
-
-# Define data loader
-    
-batch_size = 256
-if torch.cuda.is_available():
-  num_workers = 0
+if warm_start:
+    num_epochs = int(os.getenv('TRAIN_WARM_EPOCHS', '5'))
+
+### Hyperparameter sweep
+# Set `TRAIN_SWEEP` to a JSON search space to try many configurations on this machine 
+# before the main training run, e.g. 
+# `{"batch_size": [128, 256, 512], "lr": [0.01, 0.003], "num_epochs": [50, 100]}`.
+# Every combination is trained, unless `TRAIN_SWEEP_TRIALS` is set. Then that many 
+# configurations are drawn at random, and a value can also be a range such as 
+# `{"low": 0.0001, "high": 0.1, "log": true}`.
+# The trials run in `TRAIN_SWEEP_WORKERS` processes (default: one per core). They share the 
+# scaled arrays above and split the cores between them for torch threads. The ranked results go 
+# to `sweep_results.csv`, and the best configuration is used for the rest of this script.
+
+sweep_space = os.getenv('TRAIN_SWEEP')
+if sweep_space:
+    import json
+    from fraud.sweep import grid_configs, random_configs, run_sweep
+    sweep_space = json.loads(sweep_space)
+    sweep_trials = int(os.getenv('TRAIN_SWEEP_TRIALS', '0'))
+    sweep_configs = (random_configs(sweep_space, sweep_trials) if sweep_trials 
+                     else grid_configs(sweep_space))
+    sweep_start = datetime.now()
+    sweep_results = pd.DataFrame(run_sweep(
+        sweep_configs, train_set, test_set, scaler.transform(fraud_rows),
+        workers=int(os.getenv('TRAIN_SWEEP_WORKERS', '0')) or None,
+        patience=int(os.getenv('TRAIN_PATIENCE', '10'))))
+    print('\nSweep of {} configurations took {}'.format(len(sweep_configs), datetime.now() - sweep_start))
+    print(sweep_results.drop(columns='pid').to_string(index=False))
+    sweep_results.to_csv('sweep_results.csv', index=False)
+    best = sweep_results.iloc[0]
+    batch_size = int(best.get('batch_size', batch_size))
+    lr = float(best.get('lr', lr))
+    num_epochs = int(best.get('num_epochs', num_epochs))
+    print('Training with batch_size={} lr={} num_epochs={}'.format(batch_size, lr, num_epochs))
+
+# Define the minibatch iterator
+# The training set is small enough to sit in memory as one tensor, so minibatches are 
+# sliced straight out of it instead of going through a `DataLoader` with worker processes.
+# Set `TRAIN_SHUFFLE=1` to reshuffle the rows once per epoch.
+
+device = 'cuda' if torch.cuda.is_available() else 'cpu'
+shuffle = os.getenv('TRAIN_SHUFFLE', '0') == '1'
+
+if streaming:
+    train_set.device = device
+    inputs = train_set
 else:
-  num_workers = 4
-
-inputs = torch.tensor(train_set, dtype=torch.float32)
-dataset = TensorDataset(inputs)
-dataloader = DataLoader(dataset, batch_size=batch_size, num_workers=num_workers, shuffle=False)
+    inputs = torch.tensor(train_set, dtype=torch.float32).to(device)
 
-# Define loss function and optimizer
+# Early stopping
+# The loss on the held-out normal transactions in `test_set` is measured after every epoch. 
+# The weights from the best epoch are kept, and training stops once the loss has not improved 
+# for `TRAIN_PATIENCE` epochs (default 10; 0 always runs `num_epochs` but still keeps the 
+# best epoch). `TRAIN_MIN_DELTA` is the smallest drop that counts as an improvement.
 
-model = autoencoder(inputs.shape[1])
-criterion = nn.MSELoss(reduction='sum')
-optimizer = torch.optim.Adam(model.parameters(), lr=lr, weight_decay=1e-5)
-
-if torch.cuda.is_available():
-  model.to('cuda') 
-  criterion.to('cuda')
-  inputs.to('cuda')
+val_inputs = torch.tensor(test_set, dtype=torch.float32).to(device)
+early_stopping = EarlyStopping(int(os.getenv('TRAIN_PATIENCE', '10')), float(os.getenv('TRAIN_MIN_DELTA', '0')))
 
 # model training
 
-for epoch in range(num_epochs):
-    model.train()
-    loss_sum=0.0; num=0
-    for inputs1, in dataloader:
-        if torch.cuda.is_available():
-          inputs1 = inputs1.to('cuda')
-        outputs = model(inputs1)
-        loss = criterion(outputs, inputs1)
-        loss_sum+=loss.item()
-        num+=(inputs1.shape[0]*inputs1.shape[1])
-        optimizer.zero_grad()
-        loss.backward()
-        optimizer.step()
-
-    if (epoch+1)%5 == 0:
-        print('{} epoch [{}/{}], loss:{:.6f}'#, test_set_loss:{:.6f}'
-                .format(datetime.now(), epoch + 1, num_epochs, loss_sum/num))
+init_state = torch.load('model/creditcard-fraud.model', map_location=device) if warm_start else None
+model, throughput = train_autoencoder(inputs, batch_size, lr, num_epochs, shuffle,
+                                      validation=val_inputs, early_stopping=early_stopping,
+                                      init_state=init_state)
+print('Training throughput: {:.0f} samples/sec'.format(throughput.samples_per_sec))
+print('Best validation loss {:.6f} at epoch {} of {} run'.format(
+      early_stopping.best_loss, early_stopping.best_epoch, early_stopping.epochs))
 
 
 # model evaluation
 
-model.eval()
-
 with torch.no_grad():
-    test_set2 = data[data.CLASS==1][feature_names]
-    test_set2=scaler.transform(test_set2)
+    test_set2=scaler.transform(fraud_rows)
     inputs2=torch.tensor(test_set2, dtype=torch.float32)
     if torch.cuda.is_available():
       inputs2 = inputs2.to('cuda')
@@ -217,43 +291,32 @@ with torch.no_grad():
     loss2=torch.sum((inputs2-outputs2)**2,dim=1).sqrt().log()
     loss2 = loss2.cpu()
     
-    test_set1=test_set[np.random.choice(len(test_set),size=len(loss2),replace=False)]
-    inputs1=torch.tensor(test_set1, dtype=torch.float32)
-    if torch.cuda.is_available():
-      inputs1 = inputs1.to('cuda')
+    inputs1=val_inputs
     outputs1=model(inputs1)
     loss1=torch.sum((inputs1-outputs1)**2,dim=1).sqrt().log()
     loss1 = loss1.cpu()
     
-    pd.Series(loss1.numpy()).hist(bins=100)
-    pd.Series(loss2.numpy()).hist(bins=100)
-
-
-def precision_rate(split_point):
-    rate1=(loss1<split_point).sum().item()/float(len(loss1))
-    rate2=(loss2>split_point).sum().item()/float(len(loss2))
-    return (rate1+rate2)/2            
-
-def find_split_point(start,end,start_precision,end_precision):
-    print(start,'->',end)
-    delta=(end-start)/4.0
-    precision=[start_precision]
-    precision+=[precision_rate(start+i*delta) for i in range(1,4)]
-    precision+=[end_precision]
-
-    i = 0 if sum(precision[0:3])>sum(precision[1:4]) else 1
-    j = i if sum(precision[i:i+3])>sum(precision[2:5]) else 2
-
-    if end-start>0.01:
-        return find_split_point(start+j*delta,start+(j+2)*delta,precision[j],precision[j+2])
-    else:
-        return start+delta*np.argmax(precision)
-
-
-(start,end)=(loss1.max().item(),loss2.min().item())
-(start,end)=(start,end) if start<end else (end,start)
-split_point=find_split_point(start,end,precision_rate(start),precision_rate(end))
-print('\nSplit point:',split_point)
+    pd.Series(loss1.numpy()).hist(bins=100, density=True)
+    pd.Series(loss2.numpy()).hist(bins=100, density=True)
+
+
+# Split point
+# All the held-out normal scores and the fraud scores are sorted once, and every possible cut 
+# is scored, so this is the split point with the highest mean of the normal and fraud precision. 
+# To deploy an operating point with a bounded false-positive rate instead, set `TRAIN_TARGET_FPR` 
+# (e.g. `0.001`) to use the lowest split point that flags at most that share of normal cases.
+
+best_point, best_precision = best_split_point(loss1, loss2)
+print('\nBest split point: {} (precision {:.4f})'.format(best_point, best_precision))
+target_fpr = os.getenv('TRAIN_TARGET_FPR')
+if target_fpr:
+    fpr_point = operating_point(loss1, loss2, split_point_at_fpr(loss1, float(target_fpr)))
+    print('Split point at target FPR {}: {split_point} (FPR {fpr:.5f}, fraud precision {precision_fraud:.4f})'
+          .format(target_fpr, **fpr_point))
+    split_point = fpr_point['split_point']
+else:
+    split_point = best_point
+print('Split point:',split_point)
 
 # Update the deployed model split point
 import subprocess
@@ -270,10 +333,76 @@ print('Overall precision:',(precision1+precision2)/2)
 
 torch.save(model.state_dict(), 'model/creditcard-fraud.model')
 
+# Serving variants
+# Save a frozen TorchScript version of the model and one with its linear layers dynamically 
+# quantized to int8 (`MODEL_ENGINE=torchscript` / `MODEL_ENGINE=int8` in 99_model.py), and 
+# report how each one shifts the precision at the split point and how fast it scores.
+from fraud.variants import build_variants, save_variants, compare_variants
+variants = build_variants(model, inputs2[:1])
+variant_paths = save_variants(variants, 'model')
+variant_report = compare_variants(dict(fp32=model, **variants), inputs1, inputs2, split_point)
+for name, r in variant_report.items():
+    print('{:<12} precision normal {:.4f} fraud {:.4f} overall {:.4f} (delta {:+.4f}), '
+          'latency 1 row {:.3f}ms, 256 rows {:.3f}ms'.format(
+          name, r['precision_normal'], r['precision_fraud'], r['precision'],
+          r['precision'] - variant_report['fp32']['precision'], r['latency_1_ms'], r['latency_256_ms']))
+
+# Export the weights and scaler as plain float32 arrays for the NumPy scoring engine 
+# (`MODEL_ENGINE=numpy` in 99_model.py) and check it scores like the torch model.
+from fraud.numpy_engine import NumpyAutoencoder, export_arrays, check_parity
+model.cpu()
+export_arrays(model.state_dict(), scaler, 'model/creditcard-fraud.npz')
+numpy_engine = NumpyAutoencoder.load('model/creditcard-fraud.npz')
+print('NumPy engine max abs score difference:', 
+      check_parity(model, scaler, numpy_engine, fraud_rows))
+
+# Write the single-file bundle (`MODEL_ENGINE=bundle` in 99_model.py) with the weights, 
+# scaler, feature order, split point and training metadata.
+from fraud.bundle import write_bundle
+write_bundle('model/creditcard-fraud.bundle', model.state_dict(), scaler, list(feature_names), split_point,
+             {'batch_size': batch_size, 'lr': lr, 'num_epochs': num_epochs, 'train_rows': inputs.shape[0],
+              'best_epoch': early_stopping.best_epoch, 'val_loss': early_stopping.best_loss,
+              'warm_start': warm_start, 'new_rows': new_rows,
+              'precision_normal': precision1, 'precision_fraud': precision2,
+              'trained_at': datetime.now().isoformat()},
+             version=os.getenv('TRAIN_VERSION_NAME'))
+
+# Publish the artifacts as a new model version
+# Model replicas started with `MODEL_VERSIONS_DIR=model/versions` pick this version up in 
+# the background, without a rebuild or restart. Set `TRAIN_VERSION_NAME` to name the version
+# (e.g. after the experiment's hyperparameters) so requests can select it by name.
+# Only the `TRAIN_KEEP_VERSIONS` (default 10) most recently published versions are kept, 
+# plus the current one.
+from fraud.reload import publish_version
+model_version = publish_version(
+    ['model/creditcard-fraud.model', 'model/cc_scaler.pkl', 'model/creditcard-fraud.npz',
+     'model/creditcard-fraud.bundle'] + variant_paths,
+    'model/versions',
+    {'split_point': split_point, 'precision': (precision1+precision2)/2,
+     'batch_size': batch_size, 'lr': lr, 'num_epochs': num_epochs, 'best_epoch': early_stopping.best_epoch},
+    version=os.getenv('TRAIN_VERSION_NAME'), keep=int(os.getenv('TRAIN_KEEP_VERSIONS', '10')))
+print('Published model version', model_version)
+
 # track experiment metrics
 # If running as as experiment, this will track the metrics and add the model trained in this 
 # training run to the experiment history.
 cdsw.track_metric("split_point",round(split_point,2))
+if target_fpr:
+  cdsw.track_metric("best_split_point",round(best_point,2))
+  cdsw.track_metric("fpr",round(fpr_point['fpr'],5))
 cdsw.track_metric("precision",round(((precision1+precision2)/2),2))
+cdsw.track_metric("samples_per_sec",round(throughput.samples_per_sec))
+cdsw.track_metric("best_epoch",early_stopping.best_epoch)
+cdsw.track_metric("epochs_run",early_stopping.epochs)
+cdsw.track_metric("val_loss",round(early_stopping.best_loss,6))
 cdsw.track_file('model/creditcard-fraud.model')
-cdsw.track_file('model/cc_scaler.pkl')
\ No newline at end of file
+cdsw.track_file('model/cc_scaler.pkl')
+cdsw.track_file('model/creditcard-fraud.npz')
+cdsw.track_file('model/creditcard-fraud.bundle')
+if sweep_space:
+  cdsw.track_file('sweep_results.csv')
+for name, r in variant_report.items():
+  cdsw.track_metric(name + "_precision",round(r['precision'],4))
+  cdsw.track_metric(name + "_latency_1_ms",round(r['latency_1_ms'],4))
+for path in variant_paths:
+  cdsw.track_file(path)
\ No newline at end of file
@@ -134,4 +134,27 @@ while is_deployed == False:
     break
   else:
     print ("Deploying Model.....")
-    time.sleep(10)
\ No newline at end of file
+    time.sleep(10)
+### Batch scoring endpoint
+# `99_model.py` also exposes `predict_batch`, which scores a whole group of transactions in 
+# one pass. Set the `DEPLOY_BATCH_MODEL` environment variable to `true` to create a second 
+# Model that targets it, for upstream flows that already group their transactions.
+
+example_batch_input = {
+"records": [example_model_input, example_model_input]
+}
+
+if os.getenv("DEPLOY_BATCH_MODEL", "false").lower() == "true":
+  create_batch_model_params = dict(create_model_params)
+  create_batch_model_params.update({
+      "name": "Fraud Detection Batch " + run_time_suffix,
+      "description": "Fraud Detection (batch scoring)",
+      "targetFunctionName": "predict_batch",
+      "examples": [
+          {
+              "request": example_batch_input,
+              "response": {}
+          }]})
+
+  new_batch_model_details = cml.create_model(create_batch_model_params)
+  print("New batch model created with access key", new_batch_model_details["accessKey"])
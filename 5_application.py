@@ -80,24 +80,36 @@ import json
 from pyspark.sql import SparkSession
 import pandas as pd
 import requests
+from fraud.data_cache import load_cc_data, CacheUnavailable
 
-spark = SparkSession\
-    .builder\
-    .appName("PythonSQL")\
-    .master("local[*]")\
-    .getOrCreate()
-
+# The samples come from the local memory-mapped cache of `cc_data` when it can be built, 
+# so the app doesn't need to start Spark. Otherwise they are queried from Hive.
 try:
-    spark_df = spark.sql("SELECT * FROM default.cc_data")
-    class1_df = spark_df.filter("Class == 1")
-    class0_df = spark_df.filter("Class == 0").limit(2000)
-    sample_df = class1_df.union(class0_df)
-    data = sample_df.toPandas()
-except:
-    all_data = pd.read_csv("/home/cdsw/data/creditcard.csv")
-    class1_pdf = all_data[all_data.Class == 1]
-    class0_pdf = all_data[all_data.Class == 0].iloc[:2000]
-    data_ = class1_pdf.append(class0_pdf)
+    all_data = load_cc_data()
+except CacheUnavailable as e:
+    print('cc_data cache unavailable ({}), reading through Spark'.format(e))
+    data = None
+else:
+    data = pd.concat([all_data[all_data.CLASS == 1], all_data[all_data.CLASS == 0].iloc[:2000]])
+
+if data is None:
+    spark = SparkSession\
+        .builder\
+        .appName("PythonSQL")\
+        .master("local[*]")\
+        .getOrCreate()
+
+    try:
+        spark_df = spark.sql("SELECT * FROM default.cc_data")
+        class1_df = spark_df.filter("Class == 1")
+        class0_df = spark_df.filter("Class == 0").limit(2000)
+        sample_df = class1_df.union(class0_df)
+        data = sample_df.toPandas()
+    except:
+        all_data = pd.read_csv("/home/cdsw/data/creditcard.csv")
+        class1_pdf = all_data[all_data.Class == 1]
+        class0_pdf = all_data[all_data.Class == 0].iloc[:2000]
+        data_ = class1_pdf.append(class0_pdf)
     
     
 features = list(data.columns.values)
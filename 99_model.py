@@ -108,81 +108,395 @@
 # A current list of known limitations are 
 # [documented here](https://docs.cloudera.com/machine-learning/cloud/models/topics/ml-models-known-issues-and-limitations.html).
 
+import time
+_start_time=time.perf_counter()
+from contextlib import nullcontext
 from datetime import datetime
+import os
 import sys
-import torch
-import torch.nn as nn
-
-class autoencoder(nn.Module):
-    def __init__(self,num_features):
-        super(autoencoder, self).__init__()
-        self.encoder = nn.Sequential(
-            nn.Linear(num_features, 15),
-            nn.ReLU(True),
-            nn.Linear(15, 7))
-        self.decoder = nn.Sequential(
-            nn.Linear(7, 15),
-            nn.ReLU(True),
-            nn.Linear(15, num_features),
-            nn.Tanh())
-
-    def forward(self, x):
-        x = self.encoder(x)
-        x = self.decoder(x)
-        return x
+import numpy as np
+from fraud.admission import Overloaded
+from fraud.codec import decode_features
+from fraud.metrics import Metrics, NULL_METRICS
+from fraud.reload import ModelReloader, current_version
+from fraud.scorer import load_scorer, warm_up
 
 num_features=29
 split_point=-1.207
 
-import joblib
-scaler=joblib.load('model/cc_scaler.pkl')
+feature_names=['ACCOUNT_ID']+['V'+str(i) for i in range(1,29)]
 
-model = autoencoder(num_features)
-model.load_state_dict(torch.load('model/creditcard-fraud.model'))
-model.eval()
+### Scoring engine
+# By default the model is served with pytorch and the pickled `MinMaxScaler`. Setting the 
+# `MODEL_ENGINE` environment variable of the Model to `numpy` serves it from 
+# `model/creditcard-fraud.npz` instead: the same weights as plain float32 arrays with the 
+# scaler folded into the first layer, scored with NumPy only, so torch and sklearn are never 
+# imported on the serving path. The arrays are written by `3_model_train.py`, or by running
+# `python -m fraud.numpy_engine` against the files in `model/`.
+#
+# `MODEL_ENGINE=torchscript` and `MODEL_ENGINE=int8` load the frozen TorchScript module and
+# the int8 dynamically quantized one that `3_model_train.py` saves next to the model, after 
+# printing how their precision and latency compare with the original. The shipped ones are 
+# built from the shipped model by `python -m fraud.variants`.
+#
+# `MODEL_ENGINE=bundle` serves `model/creditcard-fraud.bundle`, a single versioned file 
+# with the weights, scaler parameters, feature order, split point and training metadata.
+# It is memory-mapped rather than unpickled, so it loads in milliseconds and every process
+# that maps it shares the same pages. Its split point replaces the one below.
+#
+### Startup
+# The heavy imports for the chosen engine are only done when its artifacts are loaded, and
+# a warm-up inference on a synthetic batch runs before the first request arrives (set 
+# `MODEL_WARMUP=0` to skip it). The time spent importing, loading the artifacts and warming
+# up is printed to the Model logs and kept in `startup_timings`.
+
+#
+### Hot reload
+# Every training run also publishes its artifacts and split point as a new version under
+# `model/versions/` and points `model/versions/CURRENT` at it. If the Model's 
+# `MODEL_VERSIONS_DIR` environment variable is set to that directory, the current version 
+# is loaded from there, and a background thread checks the pointer every 
+# `MODEL_RELOAD_INTERVAL` seconds (default 10). A new version's weights, scaler and split 
+# point are loaded and warmed up off the request path and then swapped in as a whole, so 
+# calls that are already running finish on the old version. The `status` function reports 
+# the active version.
+
+#
+### Metrics
+# Setting `MODEL_METRICS=1` times every stage of a request (input extraction, scaling, 
+# tensor creation, forward pass, response) into latency histograms and counts requests, 
+# fraud flags and errors. The `metrics` function of the Model returns them in the 
+# Prometheus text format along with p50/p95/p99 per stage. When it is off, the timers are 
+# shared no-ops.
+
+engine=os.getenv('MODEL_ENGINE', 'torch')
+versions_dir=os.getenv('MODEL_VERSIONS_DIR')
+warmup=os.getenv('MODEL_WARMUP', '1') != '0'
+metrics=Metrics() if os.getenv('MODEL_METRICS', '0') == '1' else NULL_METRICS
+
+def load_version(model_dir, timings=None):
+    loaded=load_scorer(engine, model_dir, num_features, split_point, timings=timings)
+    if getattr(loaded, 'feature_names', feature_names) != feature_names:
+        raise ValueError('Model in {} expects features {}'.format(model_dir, loaded.feature_names))
+    if warmup:
+        warm_up(loaded, num_features, timings=timings)
+    loaded.metrics=metrics
+    return loaded
+
+startup_timings={'base_import': time.perf_counter()-_start_time}
+if versions_dir and current_version(versions_dir):
+    scorer=load_version(os.path.join(versions_dir, current_version(versions_dir)), startup_timings)
+    reloader=ModelReloader(versions_dir, load_version, float(os.getenv('MODEL_RELOAD_INTERVAL', '10')),
+                           active=scorer).start()
+else:
+    scorer=load_version('model', startup_timings)
+    reloader=None
+
+def active_scorer():
+    return reloader.active if reloader is not None else scorer
+
+### Multiple versions
+# With `MODEL_VERSIONS_DIR` set, a request can also name any published version under it in
+# a `MODEL_VERSION` field, e.g. experiment runs with different hyperparameters or split
+# points (`3_model_train.py` names its version after `TRAIN_VERSION_NAME` when that is set).
+# Those versions are loaded on first use into this same process and evicted, least 
+# recently used first, when together they go over `MODEL_MEMORY_BUDGET_MB` (default 256).
+# A version republished under the same name is reloaded within `MODEL_RELOAD_INTERVAL`.
+# Requests without `MODEL_VERSION` are served by the current version as before.
+
+if versions_dir:
+    from fraud.registry import ModelRegistry
+    registry=ModelRegistry(versions_dir, load_version, float(os.getenv('MODEL_MEMORY_BUDGET_MB', '256'))*2**20,
+                           float(os.getenv('MODEL_RELOAD_INTERVAL', '10')))
+else:
+    registry=None
+
+def scorer_for(args):
+    version=args.get('MODEL_VERSION') if isinstance(args, dict) else None
+    if version is None:
+        return active_scorer()
+    if registry is None:
+        raise KeyError('MODEL_VERSION needs MODEL_VERSIONS_DIR to be set')
+    return registry.get(version)
+startup_timings['total']=time.perf_counter()-_start_time
+print('Model startup ({} engine): '.format(engine)
+      + ', '.join('{} {:.3f}s'.format(stage, t) for stage, t in startup_timings.items()))
+
+### Result cache
+# Retries and duplicate submissions score the same transaction several times within 
+# seconds. Setting `MODEL_CACHE_SIZE` keeps up to that many recent scores in an LRU cache, 
+# keyed by a hash of the input features and the version (content hash) of the loaded model 
+# artifacts. Entries expire after `MODEL_CACHE_TTL` seconds (default 60), or sooner when 
+# the cache is full, so entries for a replaced model version just age out. Call the `status` function of the Model to 
+# see the hit rate.
+
+cache_size=int(os.getenv('MODEL_CACHE_SIZE', '0'))
+if cache_size > 0:
+    from fraud.cache import ScoreCache
+    cache=ScoreCache(cache_size, float(os.getenv('MODEL_CACHE_TTL', '60')))
+else:
+    cache=None
+
+def score(rows, active=None):
+    """Return the log reconstruction error for each row of raw feature values."""
+    active = active or active_scorer()
+    if cache is not None:
+        return cache.score(rows, active.score, active.published_id or active.version)
+    return active.score(rows)
+
+def status(args):
+    return {
+    "engine" : engine,
+    "version" : active_scorer().version,
+    "split_point" : active_scorer().split_point,
+    "reloads" : reloader.reloads if reloader is not None else 0,
+    "startup_timings" : startup_timings,
+    "cache" : cache.stats() if cache is not None else None,
+    "admission" : admission.stats() if admission is not None else None,
+    "shadow" : shadow.stats() if shadow is not None else None,
+    "versions" : registry.stats() if registry is not None else None
+    }
+
+def metrics_text(args):
+    return {
+    "prometheus" : metrics.render(),
+    "summary" : metrics.summary()
+    }
+
+### Shadow scoring
+# Before promoting a newly trained model, point `MODEL_SHADOW_DIR` at its artifacts (e.g. a
+# directory under `model/versions/`) to score it in shadow on live traffic. The primary 
+# result is returned as usual; the candidate scores the same rows later, in batches on a 
+# background thread, and its disagreements and score deltas are appended to 
+# `MODEL_SHADOW_LOG` (default `shadow.jsonl`). The queue holds at most `MODEL_SHADOW_QUEUE` 
+# requests (default 10000); when the shadow falls behind, new rows are dropped rather than 
+# slowing down the primary path.
+
+shadow_dir=os.getenv('MODEL_SHADOW_DIR')
+if shadow_dir:
+    from fraud.shadow import ShadowScorer
+    shadow=ShadowScorer(load_scorer(engine, shadow_dir, num_features, split_point),
+                        os.getenv('MODEL_SHADOW_LOG', 'shadow.jsonl'),
+                        int(os.getenv('MODEL_SHADOW_QUEUE', '10000')))
+else:
+    shadow=None
+
+### Micro-batching
+# When many single-transaction calls arrive concurrently, setting `MODEL_BATCH_SIZE` above 1
+# queues them and scores up to that many together in one forward pass. A batch is flushed 
+# when it is full or when its oldest call has waited `MODEL_BATCH_WAIT_MS` milliseconds 
+# (default 2), so each caller waits at most that long on top of the batched inference.
+
+def _score_with_split_point(rows):
+    active = active_scorer()
+    return [(l, active.split_point) for l in score(rows, active)]
+
+batch_size=int(os.getenv('MODEL_BATCH_SIZE', '1'))
+if batch_size > 1:
+    from fraud.batching import MicroBatcher
+    batcher=MicroBatcher(_score_with_split_point, batch_size, float(os.getenv('MODEL_BATCH_WAIT_MS', '2')))
+else:
+    batcher=None
+
+def after_fork():
+    """Restart the background threads in a worker forked by `python -m fraud.server --workers N`."""
+    if batcher is not None:
+        batcher.start()
+    if reloader is not None:
+        reloader.start()
+    if shadow is not None:
+        shadow.start()
+
+### Compact requests
+# Instead of one decimal string per feature, a request can carry its features in the fixed
+# `feature_names` order as `FEATURES`, base64 encoded little-endian float32 values (see
+# `fraud.codec.encode_features`), or as `ROWS`, a list of number lists. Those requests, and 
+# any request with `"RESPONSE": "slim"` (or every request when the Model's `MODEL_RESPONSE` 
+# environment variable is `slim`), only get `ACCOUNT_ID`, `SCORE` and `RESULT` back instead
+# of an echo of all the input fields. `predict` scores exactly one row; send several rows 
+# to `predict_batch`.
+
+response_mode=os.getenv('MODEL_RESPONSE', 'full')
+
+def _account_ids(args, rows):
+    if 'ACCOUNT_ID' not in args:
+        return [int(i) for i in rows[:, 0]]
+    ids = args['ACCOUNT_ID']
+    ids = ids if isinstance(ids, list) else [ids]
+    if len(ids) != len(rows):
+        raise ValueError('{} ACCOUNT_ID values for {} rows'.format(len(ids), len(rows)))
+    return ids
+
+### Admission control
+# Under burst load a fraud check that arrives after the payment flow has timed out is 
+# useless. Setting `MODEL_MAX_IN_FLIGHT` lets at most that many calls score at once and 
+# queues at most `MODEL_MAX_QUEUE` more (default: twice as many). Each call may carry a 
+# `DEADLINE_MS` budget (default `MODEL_DEADLINE_MS`, none if unset). Calls that find the 
+# queue full, that would clearly not be scored before their deadline, or whose deadline 
+# passes while they wait, are answered at once with `"RESULT": "shed"` and the reason in 
+# `ERROR`. The accept and shed counts are reported by `status` and `metrics_text`.
+
+max_in_flight=int(os.getenv('MODEL_MAX_IN_FLIGHT', '0'))
+default_deadline_ms=os.getenv('MODEL_DEADLINE_MS')
+if max_in_flight > 0:
+    from fraud.admission import AdmissionController
+    admission=AdmissionController(max_in_flight, int(os.getenv('MODEL_MAX_QUEUE', str(2*max_in_flight))))
+else:
+    admission=None
+
+def _admitted(args, arrival):
+    if admission is None:
+        return nullcontext()
+    deadline_ms=args.get('DEADLINE_MS', default_deadline_ms) if isinstance(args, dict) else default_deadline_ms
+    return admission.admit(arrival+float(deadline_ms)/1000 if deadline_ms is not None else None)
+
+def _shed(args, reason):
+    metrics.inc('shed_' + reason)
+    return {
+    "ACCOUNT_ID" : args.get('ACCOUNT_ID') if isinstance(args, dict) else None,
+    "RESULT" : "shed",
+    "ERROR" : reason
+    }
 
 def predict(args):
-    with torch.no_grad():
-        inp=[args['ACCOUNT_ID']]+[args['V1']]+[args['V2']]+[args['V3']]+[args['V4']]+[args['V5']]+[args['V6']]+[args['V7']]+[args['V8']]+[args['V9']]+[args['V10']]+[args['V11']]+[args['V12']]+[args['V13']]+[args['V14']]+[args['V15']]+[args['V16']]+[args['V17']]+[args['V18']]+[args['V19']]+[args['V20']]+[args['V21']]+[args['V22']]+[args['V23']]+[args['V24']]+[args['V25']]+[args['V26']]+[args['V27']]+[args['V28']]
-        inp=scaler.transform([inp])
-        inp=torch.tensor(inp, dtype=torch.float32)
-        outp=model(inp)
-        loss=torch.sum((inp-outp)**2,dim=1).sqrt().log()
-        res=loss.item()>split_point
-        if res == True:
-          res_segment = "true"
-        else:
-          res_segment = "false"
+    arrival=time.perf_counter()
+    try:
+        with metrics.stage('request'), _admitted(args, arrival):
+            return _predict(args)
+    except Overloaded as e:
+        return _shed(args, e.reason)
+    except Exception:
+        metrics.inc('errors')
+        raise
+
+def _predict(args):
+    with metrics.stage('extract'):
+        rows=decode_features(args, num_features)
+        if rows is not None and len(rows) != 1:
+            raise ValueError('predict scores one row, got {}; use predict_batch for several'.format(len(rows)))
+        inp=rows[0] if rows is not None else [args[name] for name in feature_names]
+    if batcher is not None and 'MODEL_VERSION' not in args:
+        loss, threshold=batcher.submit(inp)
+    else:
+        active=scorer_for(args)
+        loss, threshold=score([inp], active)[0], active.split_point
+    res=loss>threshold
+    if shadow is not None:
+        shadow.offer([args.get('ACCOUNT_ID', inp[0])], [inp], [loss], [res])
+    metrics.inc('requests')
+    if res == True:
+      res_segment = "true"
+      metrics.inc('fraud_flags')
+    else:
+      res_segment = "false"
+    with metrics.stage('response'):
+      return _response(args, rows, loss, res_segment)
+
+def _response(args, rows, loss, res_segment):
+    if rows is not None or args.get('RESPONSE', response_mode) == 'slim':
         return {
-        "ACCOUNT_ID" : args['ACCOUNT_ID'],
-        "V1" : args['V1'],
-        "V2" : args['V2'],
-        "V3" : args['V3'],
-        "V4" : args['V4'],
-        "V5" : args['V5'],
-        "V6" : args['V6'],
-        "V7" : args['V7'],
-        "V8" : args['V8'],
-        "V9" : args['V9'],
-        "V10" : args['V10'],
-        "V11" : args['V11'],
-        "V12" : args['V12'],
-        "V13" : args['V13'],
-        "V14" : args['V14'],
-        "V15" : args['V15'],
-        "V16" : args['V16'],
-        "V17" : args['V17'],
-        "V18" : args['V18'],
-        "V19" : args['V19'],
-        "V20" : args['V20'],
-        "V21" : args['V21'],
-        "V22" : args['V22'],
-        "V23" : args['V23'],
-        "V24" : args['V24'],
-        "V25" : args['V25'],
-        "V26" : args['V26'],
-        "V27" : args['V27'],
-        "V28" : args['V28'],
-        "CLASS" : args['CLASS'],
+        "ACCOUNT_ID" : _account_ids(args, rows)[0] if rows is not None else args['ACCOUNT_ID'],
+        "SCORE" : float(loss),
         "RESULT" : res_segment
-        }
\ No newline at end of file
+        }
+    return {
+    "ACCOUNT_ID" : args['ACCOUNT_ID'],
+    "V1" : args['V1'],
+    "V2" : args['V2'],
+    "V3" : args['V3'],
+    "V4" : args['V4'],
+    "V5" : args['V5'],
+    "V6" : args['V6'],
+    "V7" : args['V7'],
+    "V8" : args['V8'],
+    "V9" : args['V9'],
+    "V10" : args['V10'],
+    "V11" : args['V11'],
+    "V12" : args['V12'],
+    "V13" : args['V13'],
+    "V14" : args['V14'],
+    "V15" : args['V15'],
+    "V16" : args['V16'],
+    "V17" : args['V17'],
+    "V18" : args['V18'],
+    "V19" : args['V19'],
+    "V20" : args['V20'],
+    "V21" : args['V21'],
+    "V22" : args['V22'],
+    "V23" : args['V23'],
+    "V24" : args['V24'],
+    "V25" : args['V25'],
+    "V26" : args['V26'],
+    "V27" : args['V27'],
+    "V28" : args['V28'],
+    "CLASS" : args['CLASS'],
+    "RESULT" : res_segment
+    }
+
+### Batch scoring
+# Upstream flows that already group transactions can call `predict_batch` instead, which
+# scores the whole group with one scaler transform and one forward pass. The input is 
+# either a list of records in the same shape as `predict` takes:
+#
+#    {"records": [{"ACCOUNT_ID": 1, "V1": "-0.96...", ..., "V28": "0.06..."}, ...]}
+#
+# or a columnar payload with one list per feature:
+#
+#    {"ACCOUNT_ID": [1, 2], "V1": ["-0.96...", "1.19..."], ..., "V28": [...]}
+#
+# or the compact `FEATURES` / `ROWS` encodings described above. The response only carries 
+# the account id, the raw score and the result per record.
+
+def _batch_rows(args):
+    if isinstance(args, dict):
+        rows = decode_features(args, num_features)
+        if rows is not None:
+            return _account_ids(args, rows), rows
+    if isinstance(args, dict) and 'records' in args:
+        args = args['records']
+    if isinstance(args, dict):
+        ids = list(args['ACCOUNT_ID'])
+        columns = [np.asarray(args[name], dtype=np.float64) for name in feature_names]
+        if any(len(column) != len(ids) for column in columns):
+            raise ValueError('{} ACCOUNT_ID values for feature columns of length {}'.format(
+                len(ids), sorted(set(len(column) for column in columns))))
+        rows = np.column_stack(columns)
+    else:
+        ids = [rec['ACCOUNT_ID'] for rec in args]
+        rows = [[rec[name] for name in feature_names] for rec in args]
+    return ids, rows
+
+def predict_batch(args):
+    arrival=time.perf_counter()
+    try:
+        with metrics.stage('batch_request'), _admitted(args, arrival):
+            return _predict_batch(args)
+    except Overloaded as e:
+        return dict(_shed(args, e.reason), results=[])
+    except Exception:
+        metrics.inc('errors')
+        raise
+
+def _predict_batch(args):
+    with metrics.stage('extract'):
+        ids, rows = _batch_rows(args)
+    if len(ids) == 0:
+        return {"results": []}
+    active = scorer_for(args)
+    loss = score(rows, active)
+    flags = loss > active.split_point
+    if shadow is not None:
+        shadow.offer(ids, rows, loss, flags)
+    metrics.inc('requests', len(ids))
+    metrics.inc('fraud_flags', int(np.count_nonzero(flags)))
+    with metrics.stage('response'):
+        return {
+        "results" : [
+            {
+            "ACCOUNT_ID" : account_id,
+            "SCORE" : float(l),
+            "RESULT" : "true" if flag else "false"
+            }
+            for account_id, l, flag in zip(ids, loss, flags)
+        ]
+        }
@@ -0,0 +1 @@
+"""Helpers shared by the fraud detection scripts and the deployed model."""
@@ -0,0 +1,78 @@
+"""Admission control and deadlines for the scoring path.
+
+`AdmissionController.admit(deadline)` lets at most `max_in_flight` calls
+score at once and queues at most `max_queue` more. A call is shed straight
+away with `Overloaded` when the queue is full, or when the estimated time to
+get through the queue and be scored (from a moving average of recent service
+times) would already overrun its deadline. A queued call whose deadline passes
+while it waits is shed too. Shed and accepted calls are counted by reason, so
+overload fails the excess calls fast instead of slowing every caller down.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+class Overloaded(Exception):
+    def __init__(self, reason):
+        super(Overloaded, self).__init__(reason)
+        self.reason = reason
+
+class AdmissionController(object):
+    def __init__(self, max_in_flight, max_queue, clock=time.perf_counter):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.clock = clock
+        self.in_flight = 0
+        self.waiting = 0
+        self.accepted = 0
+        self.shed = {'queue_full': 0, 'deadline': 0, 'expired': 0}
+        self.service_time = 0.0
+        self._cond = threading.Condition()
+
+    def _shed(self, reason):
+        self.shed[reason] += 1
+        raise Overloaded(reason)
+
+    def _estimated_finish(self, now):
+        busy = self.in_flight >= self.max_in_flight
+        rounds = self.waiting // self.max_in_flight + (1 if busy else 0) + 1
+        return now + rounds * self.service_time
+
+    @contextmanager
+    def admit(self, deadline=None):
+        """Hold a scoring slot for the block, or raise `Overloaded`. `deadline` is a `clock()` time."""
+        with self._cond:
+            now = self.clock()
+            if self.in_flight >= self.max_in_flight and self.waiting >= self.max_queue:
+                self._shed('queue_full')
+            if deadline is not None and self._estimated_finish(now) > deadline:
+                self._shed('deadline')
+            self.waiting += 1
+            try:
+                while self.in_flight >= self.max_in_flight:
+                    remaining = None if deadline is None else deadline - self.clock()
+                    if remaining is not None and remaining <= 0:
+                        self._shed('expired')
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+            self.accepted += 1
+        start = self.clock()
+        try:
+            yield
+        finally:
+            elapsed = self.clock() - start
+            with self._cond:
+                self.in_flight -= 1
+                self.service_time = elapsed if not self.service_time else 0.9 * self.service_time + 0.1 * elapsed
+                self._cond.notify()
+
+    def stats(self):
+        return {
+            'accepted': self.accepted,
+            'shed': dict(self.shed),
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'service_time_ms': self.service_time * 1000,
+        }
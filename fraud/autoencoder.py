@@ -0,0 +1,19 @@
+import torch.nn as nn
+
+class autoencoder(nn.Module):
+    def __init__(self,num_features):
+        super(autoencoder, self).__init__()
+        self.encoder = nn.Sequential(
+            nn.Linear(num_features, 15),
+            nn.ReLU(True),
+            nn.Linear(15, 7))
+        self.decoder = nn.Sequential(
+            nn.Linear(7, 15),
+            nn.ReLU(True),
+            nn.Linear(15, num_features),
+            nn.Tanh())
+
+    def forward(self, x):
+        x = self.encoder(x)
+        x = self.decoder(x)
+        return x
@@ -0,0 +1,79 @@
+"""Dynamic micro-batching of concurrent single-row scoring calls.
+
+`MicroBatcher.submit` queues one row of raw features and blocks until its
+score is ready. A background thread takes the queued rows and scores them with
+one call to `score_fn` as soon as `max_batch_size` rows are waiting or the
+oldest row has waited `max_wait_ms`, whichever comes first. That bounds the
+extra latency a caller can see to the wait limit plus one batched forward
+pass.
+"""
+import queue
+import threading
+import time
+import numpy as np
+
+class _Pending(object):
+    __slots__ = ('row', 'done', 'result', 'error')
+
+    def __init__(self, row):
+        self.row = row
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class MicroBatcher(object):
+    def __init__(self, score_fn, max_batch_size=32, max_wait_ms=2.0):
+        self.score_fn = score_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.batches = 0
+        self.rows = 0
+        self.start()
+
+    def start(self):
+        """Start the batching thread, or restart it in a forked worker process."""
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, row):
+        """Score one row of raw features together with whatever else is queued."""
+        pending = _Pending(np.asarray(row, dtype=np.float64))
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                scores = self.score_fn(np.stack([p.row for p in batch]))
+                for p, s in zip(batch, scores):
+                    p.result = s
+            except Exception as e:
+                for p in batch:
+                    p.error = e
+            self.batches += 1
+            self.rows += len(batch)
+            for p in batch:
+                p.done.set()
+
+    @property
+    def mean_batch_size(self):
+        return self.rows / float(self.batches) if self.batches else 0.0
@@ -0,0 +1,233 @@
+"""Serving benchmark for the fraud scorer.
+
+Replays recorded requests (a JSON lines file with one `predict` input per
+line, either bare or wrapped in a CML `{"request": ...}` envelope) or synthetic
+ones against the scorer, either in process or over HTTP through the local
+stand-in in `fraud.server`, at every combination of the given concurrency
+levels and batch sizes. A batch size above 1 sends groups of records to
+`predict_batch`.
+
+Only calls that succeed count towards throughput and latency. Failed calls
+are counted under `errors`.
+
+The results are written as JSON so runs on different commits can be compared:
+`--compare` prints the change against an earlier result file and exits with
+status 1 if throughput dropped by more than `--max-regression` or any call
+failed.
+
+    python -m fraud.bench --concurrency 1,8 --batch-size 1,32 --out bench.json
+    python -m fraud.bench --mode http --compare bench.json
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from fraud.server import load_model_script, make_server
+
+FEATURES = ['ACCOUNT_ID'] + ['V' + str(i) for i in range(1, 29)]
+
+def load_requests(path):
+    requests = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                record = json.loads(line)
+                requests.append(record.get('request', record))
+    return requests
+
+def synthetic_requests(n, seed=42):
+    rng = np.random.RandomState(seed)
+    requests = []
+    for i in range(n):
+        record = {'ACCOUNT_ID': int(rng.randint(1, 6))}
+        record.update(('V' + str(j), repr(float(v))) for j, v in enumerate(rng.randn(28), 1))
+        record['CLASS'] = '0'
+        requests.append(record)
+    return requests
+
+def percentile_ms(latencies, q):
+    return float(np.percentile(latencies, q) * 1000) if len(latencies) else 0.0
+
+class InProcessTarget(object):
+    def __init__(self, model):
+        self.model = model
+
+    def connect(self):
+        return self.model
+
+    def call(self, model, function, request):
+        return getattr(model, function)(request)
+
+class HttpTarget(object):
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self._local = threading.local()
+
+    def connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port)
+            conn.connect()
+            conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return conn
+
+    def call(self, conn, function, request):
+        path = '/model' if function == 'predict' else '/model/' + function
+        conn.request('POST', path, json.dumps({'accessKey': '', 'request': request}),
+                     {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        body = response.read()
+        if response.status != 200:
+            raise RuntimeError('HTTP {}: {}'.format(response.status, body[:200]))
+        return json.loads(body)['response']
+
+def run(target, requests, concurrency, batch_size, duration):
+    if not 1 <= batch_size <= len(requests):
+        raise ValueError('batch size {} needs between 1 and {} requests'.format(batch_size, len(requests)))
+    if batch_size > 1:
+        calls = [('predict_batch', {'records': requests[i:i + batch_size]})
+                 for i in range(0, len(requests) - batch_size + 1, batch_size)]
+    else:
+        calls = [('predict', r) for r in requests]
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    stop_at = time.perf_counter() + duration
+
+    def worker(w):
+        conn = target.connect()
+        i = w
+        while time.perf_counter() < stop_at:
+            function, request = calls[i % len(calls)]
+            start = time.perf_counter()
+            try:
+                target.call(conn, function, request)
+            except Exception:
+                errors[w] += 1
+            else:
+                latencies[w].append(time.perf_counter() - start)
+            i += concurrency
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - start
+    all_latencies = np.concatenate([np.asarray(l) for l in latencies])
+    return {
+        'concurrency': concurrency,
+        'batch_size': batch_size,
+        'calls': int(len(all_latencies)),
+        'errors': int(sum(errors)),
+        'seconds': elapsed,
+        'calls_per_s': len(all_latencies) / elapsed,
+        'records_per_s': len(all_latencies) * batch_size / elapsed,
+        'p50_ms': percentile_ms(all_latencies, 50),
+        'p95_ms': percentile_ms(all_latencies, 95),
+        'p99_ms': percentile_ms(all_latencies, 99),
+        'max_ms': float(all_latencies.max() * 1000) if len(all_latencies) else 0.0,
+    }
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+def compare(results, baseline, max_regression):
+    """Print throughput changes against `baseline`, return False on a regression or failed calls."""
+    previous = {(r['mode'], r['concurrency'], r['batch_size']): r for r in baseline['results']}
+    ok = True
+    for r in results['results']:
+        if r['errors']:
+            ok = False
+            print('{:<10} c={:<4} b={:<4} {} of {} calls failed  ERRORS'.format(
+                r['mode'], r['concurrency'], r['batch_size'], r['errors'], r['calls'] + r['errors']))
+        old = previous.get((r['mode'], r['concurrency'], r['batch_size']))
+        if old is None or not old['records_per_s']:
+            continue
+        change = r['records_per_s'] / old['records_per_s'] - 1
+        regressed = change < -max_regression
+        ok = ok and not regressed
+        print('{:<10} c={:<4} b={:<4} records/s {:>10.0f} -> {:>10.0f} ({:+.1%}) p99 {:.3f}ms -> {:.3f}ms{}'.format(
+            r['mode'], r['concurrency'], r['batch_size'], old['records_per_s'], r['records_per_s'],
+            change, old['p99_ms'], r['p99_ms'], '  REGRESSION' if regressed else ''))
+    return ok
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--script', default='99_model.py')
+    parser.add_argument('--requests', help='JSON lines file of recorded requests (default: synthetic)')
+    parser.add_argument('--synthetic', type=int, default=1000, help='number of synthetic requests')
+    parser.add_argument('--mode', default='inprocess', help='inprocess, http or both')
+    parser.add_argument('--url', help='host:port of a running server to use for http mode')
+    parser.add_argument('--concurrency', default='1,4,16')
+    parser.add_argument('--batch-size', default='1,32')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per configuration')
+    parser.add_argument('--out', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='earlier result file to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    requests = load_requests(args.requests) if args.requests else synthetic_requests(args.synthetic)
+    concurrencies = [int(c) for c in args.concurrency.split(',')]
+    batch_sizes = [int(b) for b in args.batch_size.split(',')]
+    if not requests:
+        parser.error('no requests to replay')
+    if min(concurrencies) < 1:
+        parser.error('--concurrency must be at least 1')
+    if min(batch_sizes) < 1 or max(batch_sizes) > len(requests):
+        parser.error('--batch-size must be between 1 and the number of requests ({})'.format(len(requests)))
+    modes = ['inprocess', 'http'] if args.mode == 'both' else [args.mode]
+    model = load_model_script(args.script) if 'inprocess' in modes or not args.url else None
+    server = None
+    targets = {}
+    if 'inprocess' in modes:
+        targets['inprocess'] = InProcessTarget(model)
+    if 'http' in modes:
+        if args.url:
+            host, port = args.url.rsplit(':', 1)
+        else:
+            server = make_server(model, '127.0.0.1', 0)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            host, port = server.server_address
+        targets['http'] = HttpTarget(host, int(port))
+
+    results = {
+        'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'engine': os.getenv('MODEL_ENGINE', 'torch'),
+        'requests': args.requests or 'synthetic:{}'.format(args.synthetic),
+        'results': [],
+    }
+    for mode in modes:
+        for concurrency in concurrencies:
+            for batch_size in batch_sizes:
+                r = run(targets[mode], requests, concurrency, batch_size, args.duration)
+                r['mode'] = mode
+                results['results'].append(r)
+                print('{:<10} c={:<4} b={:<4} {:>10.0f} records/s  p50 {:.3f}ms  p95 {:.3f}ms  p99 {:.3f}ms  errors {}'.format(
+                    mode, concurrency, batch_size, r['records_per_s'], r['p50_ms'], r['p95_ms'], r['p99_ms'], r['errors']))
+    if server is not None:
+        server.shutdown()
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            if not compare(results, json.load(f), args.max_regression):
+                sys.exit(1)
+
+if __name__ == '__main__':
+    main()
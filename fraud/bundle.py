@@ -0,0 +1,104 @@
+"""Single-file, memory-mappable model bundle.
+
+A bundle holds everything the scorer needs in one flat file:
+
+    b'FRAUDBN1' | header length (uint64, little-endian) | JSON header | arrays
+
+The JSON header carries the bundle version, feature order, split point,
+training metadata and, for every array, its byte offset, shape and dtype.
+The arrays are the NumPy engine's float32 weights with the scaler folded in,
+followed by the original layer weights and scaler parameters under their
+state_dict / scaler attribute names. Each array starts on a 64-byte
+boundary.
+
+`load_bundle` maps the file with `np.memmap` and returns views into it, so
+loading takes milliseconds, nothing is unpickled, and processes that map
+the same bundle share its pages in the page cache.
+"""
+import json
+import os
+import struct
+from datetime import datetime
+import numpy as np
+
+from fraud.numpy_engine import NumpyAutoencoder, fold_arrays
+
+MAGIC = b'FRAUDBN1'
+ALIGN = 64
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+def write_bundle(path, state_dict, scaler, feature_names, split_point, metadata=None, version=None):
+    arrays = fold_arrays(state_dict, scaler)
+    arrays.update((name, t.detach().cpu().numpy()) for name, t in state_dict.items())
+    for attr in ('data_min_', 'data_max_'):
+        arrays['scaler.' + attr] = np.asarray(getattr(scaler, attr))
+    arrays = {name: np.ascontiguousarray(a, dtype='<f4') for name, a in arrays.items()}
+
+    layout = {}
+    offset = 0
+    for name, a in arrays.items():
+        layout[name] = {'offset': offset, 'shape': list(a.shape), 'dtype': a.dtype.str}
+        offset = _align(offset + a.nbytes)
+    header = json.dumps({
+        'format': 1,
+        'version': version or datetime.now().strftime('%Y%m%d%H%M%S'),
+        'feature_names': list(feature_names),
+        'num_features': len(feature_names),
+        'split_point': float(split_point),
+        'metadata': metadata or {},
+        'arrays': layout,
+    }).encode('utf-8')
+    data_start = _align(len(MAGIC) + 8 + len(header))
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC + struct.pack('<Q', len(header)) + header)
+        for name, a in arrays.items():
+            f.seek(data_start + layout[name]['offset'])
+            f.write(a.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp, path)
+    return path
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a model bundle'.format(path))
+        length, = struct.unpack('<Q', f.read(8))
+        return json.loads(f.read(length).decode('utf-8')), _align(len(MAGIC) + 8 + length)
+
+def load_bundle(path):
+    """Return the bundle header and a dict of read-only arrays mapped from `path`."""
+    header, data_start = read_header(path)
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype = np.dtype(spec['dtype'])
+        start = data_start + spec['offset']
+        count = int(np.prod(spec['shape'])) if spec['shape'] else 1
+        arrays[name] = data[start:start + count * dtype.itemsize].view(dtype).reshape(spec['shape'])
+    return header, arrays
+
+def load_bundle_scorer(path):
+    header, arrays = load_bundle(path)
+    scorer = NumpyAutoencoder(arrays)
+    scorer.engine = 'bundle'
+    scorer.feature_names = header['feature_names']
+    scorer.version = header['version']
+    scorer.split_point = header['split_point']
+    scorer.metadata = header['metadata']
+    return scorer
+
+if __name__ == '__main__':
+    # Build a bundle from the separate artifacts in model/ and the given split point.
+    import sys
+    import joblib
+    import torch
+
+    split_point = float(sys.argv[1]) if len(sys.argv) > 1 else -1.207
+    scaler = joblib.load('model/cc_scaler.pkl')
+    state_dict = torch.load('model/creditcard-fraud.model')
+    feature_names = list(getattr(scaler, 'feature_names_in_', ['ACCOUNT_ID'] + ['V' + str(i) for i in range(1, 29)]))
+    print(write_bundle('model/creditcard-fraud.bundle', state_dict, scaler, feature_names, split_point))
@@ -0,0 +1,66 @@
+"""Bounded LRU cache of scores for repeated transactions.
+
+Entries are keyed by a hash of the raw feature values and the version of the
+model that produced them, so a model change can never serve a stale score.
+Requests routed to different versions share the cache, and entries for a
+version that is no longer used simply age out through the LRU order and
+`ttl`. Entries older than `ttl` seconds are treated as misses and evicted.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+class ScoreCache(object):
+    def __init__(self, maxsize=10000, ttl=60.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, row, version):
+        return hashlib.blake2b(row.tobytes(), digest_size=16, key=version.encode()[:64]).digest()
+
+    def score(self, rows, score_fn, version):
+        """Score `rows` with `score_fn`, only computing the rows that are not cached."""
+        rows = np.asarray(rows, dtype=np.float64)
+        now = self.clock()
+        scores = np.empty(len(rows))
+        missing = []
+        with self._lock:
+            keys = [self._key(row, version) for row in rows]
+            for i, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is not None and now - entry[1] <= self.ttl:
+                    self._entries.move_to_end(key)
+                    scores[i] = entry[0]
+                else:
+                    missing.append(i)
+            self.hits += len(rows) - len(missing)
+            self.misses += len(missing)
+        if missing:
+            scores[missing] = score_fn(rows[missing])
+            with self._lock:
+                for i in missing:
+                    self._entries[keys[i]] = (scores[i], now)
+                    self._entries.move_to_end(keys[i])
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return scores
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / float(total) if total else 0.0,
+        }
@@ -0,0 +1,28 @@
+"""Compact request encodings for the scoring API.
+
+Besides one `V1`..`V28` key per feature, a request can carry its features in
+the fixed `feature_names` order (`ACCOUNT_ID`, `V1`, ..., `V28`) as either
+
+* `FEATURES`: base64 of little-endian float32 values, one or more rows back
+  to back, decoded with a single `np.frombuffer`, or
+* `ROWS`: a list of rows, each a list of numbers.
+
+`encode_features` produces the `FEATURES` string on the client side.
+"""
+import base64
+import numpy as np
+
+def encode_features(rows):
+    return base64.b64encode(np.ascontiguousarray(rows, dtype='<f4').tobytes()).decode('ascii')
+
+def decode_features(args, num_features):
+    """Return the compact features in `args` as an (n, num_features) array, or None."""
+    if 'FEATURES' in args:
+        rows = np.frombuffer(base64.b64decode(args['FEATURES']), dtype='<f4')
+    elif 'ROWS' in args:
+        rows = np.asarray(args['ROWS'], dtype=np.float32)
+    else:
+        return None
+    if rows.size % num_features:
+        raise ValueError('Expected rows of {} features, got {} values'.format(num_features, rows.size))
+    return rows.reshape(-1, num_features)
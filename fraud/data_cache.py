@@ -0,0 +1,101 @@
+"""Local memory-mapped copy of the `cc_data` table.
+
+Training, the application and the notebook read `cc_data` through this
+cache so they don't need a Spark session just to load the data.
+
+`cache_table` lists the Parquet files behind the table and hashes their
+paths, sizes and modification times into a snapshot key. A new snapshot is
+built when no directory for that key exists yet, so the cache refreshes by
+itself whenever the table changes. A build reads one column at a time with
+`pyarrow` and writes it as `<column>.npy`, with floats stored as float32.
+It writes into a temporary directory that is renamed into place, so readers
+never see a half-written snapshot. Older snapshots are deleted afterwards.
+
+`load_columns` memory-maps the `.npy` files, and `load_cc_data` wraps them
+in a DataFrame with the table's column order. When `pyarrow` is missing or
+the table's files can't be reached, they raise `CacheUnavailable`, and
+callers fall back to Spark.
+"""
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from fraud.parquet_input import open_dataset, default_table_path
+
+MANIFEST = 'manifest.json'
+
+class CacheUnavailable(Exception):
+    """The table's Parquet files can't be read directly."""
+
+def default_cache_dir():
+    return os.getenv('CC_DATA_CACHE_DIR', 'data/cache')
+
+def snapshot_key(dataset):
+    """Hash of the path, size and modification time of every file in `dataset`."""
+    digest = hashlib.blake2b(digest_size=8)
+    for info in dataset.filesystem.get_file_info(sorted(dataset.files)):
+        digest.update('{}\0{}\0{}\n'.format(info.path, info.size, info.mtime_ns).encode())
+    return digest.hexdigest()
+
+def _column_array(column):
+    import pyarrow as pa
+    if pa.types.is_dictionary(column.type):
+        column = column.cast(column.type.value_type)
+    if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        return np.array(column.to_pylist(), dtype=str)
+    values = column.to_numpy()
+    return values.astype(np.float32) if values.dtype == np.float64 else values
+
+def _build(dataset, path, key):
+    staging = '{}.tmp{}'.format(path, os.getpid())
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    columns = dataset.schema.names
+    rows = 0
+    for name in columns:
+        values = _column_array(dataset.to_table(columns=[name]).column(0))
+        np.save(os.path.join(staging, name + '.npy'), values)
+        rows = len(values)
+    with open(os.path.join(staging, MANIFEST), 'w') as f:
+        json.dump({'snapshot': key, 'columns': columns, 'rows': rows,
+                   'files': len(dataset.files)}, f, indent=2)
+    try:
+        os.rename(staging, path)
+    except OSError:
+        # Another process built the same snapshot first.
+        shutil.rmtree(staging, ignore_errors=True)
+
+def cache_table(source=None, cache_dir=None):
+    """Return the directory holding the current snapshot of `source`, building it if needed."""
+    cache_dir = cache_dir or default_cache_dir()
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise CacheUnavailable(str(e))
+    try:
+        dataset = open_dataset(source or default_table_path())
+        key = snapshot_key(dataset)
+    except (OSError, pyarrow.ArrowException) as e:
+        raise CacheUnavailable('{}: {}'.format(type(e).__name__, e))
+    path = os.path.join(cache_dir, key)
+    if not os.path.exists(os.path.join(path, MANIFEST)):
+        os.makedirs(cache_dir, exist_ok=True)
+        print('Caching cc_data snapshot {} in {}'.format(key, cache_dir))
+        _build(dataset, path, key)
+        for name in os.listdir(cache_dir):
+            if name != key and '.tmp' not in name:
+                shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+    return path
+
+def load_columns(source=None, cache_dir=None):
+    """Memory-mapped arrays for each column of the current snapshot, in table order."""
+    path = cache_table(source, cache_dir)
+    with open(os.path.join(path, MANIFEST)) as f:
+        columns = json.load(f)['columns']
+    return {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in columns}
+
+def load_cc_data(source=None, cache_dir=None):
+    """`cc_data` as a DataFrame backed by the cached columns."""
+    return pd.DataFrame(load_columns(source, cache_dir), copy=False)
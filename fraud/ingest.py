@@ -0,0 +1,45 @@
+"""File-level watermark for incremental ingest into `cc_data`.
+
+The ingest state records each source file already loaded into the table,
+with the size and modification time it had at the time. `pending_files`
+compares a fresh listing against the state and returns only the new files.
+An unchanged input directory costs one listing, and a new daily drop costs
+only its own size. Source files are treated as immutable drops. Appending a
+file that changed after it was loaded would duplicate its earlier rows, so
+`changed_files` reports those files and they are not loaded again.
+
+The state is a small JSON file. `save_state` writes it to a temporary file
+and renames it into place, so a failed run leaves the previous watermark.
+"""
+import json
+import os
+
+def load_state(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_state(path, state):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+def pending_files(listing, state):
+    """Paths in `listing` (`(path, size, mtime)` tuples) that are not in `state` yet."""
+    return [path for path, size, mtime in listing if path not in state]
+
+def changed_files(listing, state):
+    """Paths in `listing` already loaded, but with a different size or mtime since."""
+    return [path for path, size, mtime in listing if path in state and state[path] != [size, mtime]]
+
+def record_files(state, listing, paths):
+    """`state` with `paths` marked as loaded at their size and mtime in `listing`."""
+    loaded = set(paths)
+    state = dict(state)
+    state.update({path: [size, mtime] for path, size, mtime in listing if path in loaded})
+    return state
@@ -0,0 +1,135 @@
+"""Low-overhead latency histograms and counters for the scoring path.
+
+`Metrics.stage(name)` times a block into a histogram with fixed, roughly
+logarithmic buckets from 10us to 10s, from which p50/p95/p99 are estimated.
+`inc` bumps a counter. `render` returns everything in the Prometheus text
+exposition format.
+
+When metrics are disabled the scoring code talks to `NULL_METRICS` instead,
+whose `stage` hands back one shared no-op context manager and whose `inc`
+does nothing, so the hot path only pays for an attribute lookup and an
+empty `with` block.
+"""
+import bisect
+import threading
+import time
+
+BUCKETS = [b * 10.0 ** e for e in range(-5, 1) for b in (1, 2.5, 5)] + [10.0]
+
+class Histogram(object):
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        """Estimate the `q` quantile by interpolating inside its bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if c and seen + c >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / c
+            seen += c
+        return self.buckets[-1]
+
+class _Timer(object):
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+class Metrics(object):
+    enabled = True
+
+    def __init__(self, prefix='fraud_model'):
+        self.prefix = prefix
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name):
+        h = self.histograms.get(name)
+        if h is None:
+            with self._lock:
+                h = self.histograms.setdefault(name, Histogram())
+        return h
+
+    def stage(self, name):
+        return _Timer(self.histogram(name))
+
+    def inc(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self):
+        return {
+            'stages': {
+                name: {'count': h.count, 'p50': h.quantile(0.5), 'p95': h.quantile(0.95), 'p99': h.quantile(0.99)}
+                for name, h in self.histograms.items()
+            },
+            'counters': dict(self.counters),
+        }
+
+    def render(self):
+        name = self.prefix + '_stage_seconds'
+        lines = ['# TYPE {} histogram'.format(name)]
+        for stage, h in sorted(self.histograms.items()):
+            cumulative = 0
+            for le, c in zip(h.buckets + [float('inf')], h.counts):
+                cumulative += c
+                lines.append('{}_bucket{{stage="{}",le="{}"}} {}'.format(
+                    name, stage, '+Inf' if le == float('inf') else repr(le), cumulative))
+            lines.append('{}_sum{{stage="{}"}} {}'.format(name, stage, repr(h.sum)))
+            lines.append('{}_count{{stage="{}"}} {}'.format(name, stage, h.count))
+        for counter, value in sorted(self.counters.items()):
+            lines.append('# TYPE {}_{}_total counter'.format(self.prefix, counter))
+            lines.append('{}_{}_total {}'.format(self.prefix, counter, value))
+        return '\n'.join(lines) + '\n'
+
+class _NullContext(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class NullMetrics(object):
+    enabled = False
+    _context = _NullContext()
+
+    def stage(self, name):
+        return self._context
+
+    def inc(self, name, n=1):
+        pass
+
+    def summary(self):
+        return None
+
+    def render(self):
+        return ''
+
+NULL_METRICS = NullMetrics()
@@ -0,0 +1,90 @@
+"""Torch-free scoring engine for the fraud autoencoder.
+
+`export_arrays` flattens a trained `autoencoder` state_dict and the fitted
+`MinMaxScaler` into a few float32 arrays saved with `np.savez`. The scaler's
+affine transform is folded into the first encoder layer, so the hidden
+activations are computed straight from the raw features. `NumpyAutoencoder`
+loads those arrays and computes the same `sqrt(sum sq err).log()` score as
+the torch model with plain NumPy matmuls.
+
+Run `python -m fraud.numpy_engine` to export the arrays from the artifacts in
+`model/` and check them against the torch model.
+"""
+import numpy as np
+from fraud.metrics import NULL_METRICS
+
+def fold_arrays(state_dict, scaler):
+    """Return the float32 arrays the engine scores with, keyed by name."""
+    sd = {k: v.detach().cpu().double().numpy() for k, v in state_dict.items()}
+    scale = np.asarray(scaler.scale_, dtype=np.float64)
+    offset = np.asarray(scaler.min_, dtype=np.float64)
+    w1, b1 = sd['encoder.0.weight'], sd['encoder.0.bias']
+    # W1 @ (x * scale + offset) + b1 == (W1 * scale) @ x + (W1 @ offset + b1)
+    arrays = {
+        'w1': (w1 * scale).T, 'b1': w1 @ offset + b1,
+        'w2': sd['encoder.2.weight'].T, 'b2': sd['encoder.2.bias'],
+        'w3': sd['decoder.0.weight'].T, 'b3': sd['decoder.0.bias'],
+        'w4': sd['decoder.2.weight'].T, 'b4': sd['decoder.2.bias'],
+        'scale': scale, 'offset': offset,
+    }
+    return {k: np.ascontiguousarray(v, dtype=np.float32) for k, v in arrays.items()}
+
+def export_arrays(state_dict, scaler, path):
+    np.savez(path, **fold_arrays(state_dict, scaler))
+
+class NumpyAutoencoder(object):
+    engine = 'numpy'
+
+    def __init__(self, arrays):
+        for name in ('w1', 'b1', 'w2', 'b2', 'w3', 'b3', 'w4', 'b4', 'scale', 'offset'):
+            setattr(self, name, np.ascontiguousarray(arrays[name], dtype=np.float32))
+        self.num_features = self.w1.shape[0]
+        self.metrics = NULL_METRICS
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            return cls(arrays)
+
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in ('w1', 'b1', 'w2', 'b2', 'w3', 'b3', 'w4', 'b4', 'scale', 'offset'))
+
+    def score(self, rows):
+        """Return the log reconstruction error for each row of raw feature values."""
+        with self.metrics.stage('tensor'):
+            x = np.asarray(rows, dtype=np.float32).reshape(-1, self.num_features)
+        with self.metrics.stage('forward'):
+            h = np.maximum(x @ self.w1 + self.b1, 0)
+            h = h @ self.w2 + self.b2
+            h = np.maximum(h @ self.w3 + self.b3, 0)
+            err = x * self.scale + self.offset - np.tanh(h @ self.w4 + self.b4)
+            return np.log(np.sqrt(np.einsum('ij,ij->i', err, err)))
+
+def check_parity(model, scaler, engine, rows, atol=1e-4):
+    """Compare `engine` scores with the torch `model` on raw `rows`, return the max abs diff."""
+    import torch
+    rows = np.asarray(rows, dtype=np.float64)
+    with torch.no_grad():
+        inp = torch.tensor(scaler.transform(rows), dtype=torch.float32)
+        expected = torch.sum((inp - model(inp))**2, dim=1).sqrt().log().numpy()
+    diff = float(np.max(np.abs(engine.score(rows) - expected)))
+    if not diff <= atol:
+        raise AssertionError('numpy engine differs from torch model by {} (tolerance {})'.format(diff, atol))
+    return diff
+
+if __name__ == '__main__':
+    import joblib
+    import torch
+    from fraud.autoencoder import autoencoder
+
+    scaler = joblib.load('model/cc_scaler.pkl')
+    model = autoencoder(scaler.n_features_in_)
+    model.load_state_dict(torch.load('model/creditcard-fraud.model'))
+    model.eval()
+    export_arrays(model.state_dict(), scaler, 'model/creditcard-fraud.npz')
+
+    # random rows spread over the range the scaler was fitted on
+    rng = np.random.RandomState(42)
+    rows = scaler.data_min_ + rng.rand(10000, scaler.n_features_in_) * scaler.data_range_
+    engine = NumpyAutoencoder.load('model/creditcard-fraud.npz')
+    print('Max abs score difference vs torch:', check_parity(model, scaler, engine, rows))
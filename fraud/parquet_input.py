@@ -0,0 +1,97 @@
+"""Streaming training input from the Parquet files behind `cc_data`.
+
+`ParquetRows` reads the table's files with `pyarrow.dataset` one record
+batch at a time. It reads only the feature and label columns, straight into
+float32 arrays, so the table never has to fit in memory.
+
+`fit` makes one pass over the data. It fits the `MinMaxScaler` with
+`partial_fit` on the training rows and keeps the held-out normal rows (up to
+`max_holdout`) and all fraud rows for evaluation. Each row's train/holdout
+assignment comes from a random generator seeded with the batch index, so
+every later pass splits the rows the same way.
+
+`minibatches` is the per-epoch pass over the training rows. It scales each
+record batch and slices it into minibatches, carrying leftover rows into
+the next record batch. With `shuffle`, rows are shuffled within each record
+batch only.
+"""
+import os
+import numpy as np
+import torch
+from sklearn.preprocessing import MinMaxScaler
+from fraud.training import iterate_minibatches
+
+def default_table_path():
+    """Location of the `cc_data` Parquet files, `CC_DATA_PATH` or the Hive warehouse under `STORAGE`."""
+    return os.getenv('CC_DATA_PATH', 
+                     os.getenv('STORAGE', '') + '/data/warehouse/tablespace/external/hive/cc_data')
+
+def open_dataset(path):
+    import pyarrow.dataset as ds
+    if path.startswith('s3a://'):
+        path = 's3://' + path[len('s3a://'):]
+    return ds.dataset(path, format='parquet', partitioning='hive')
+
+class ParquetRows(object):
+    """Normal training rows from a Parquet table, streamed per epoch."""
+
+    def __init__(self, path, feature_names, label='CLASS', holdout=0.2, max_holdout=100000,
+                 batch_rows=65536, seed=42, device='cpu'):
+        self.dataset = open_dataset(path)
+        self.feature_names = list(feature_names)
+        self.label = label
+        self.holdout = holdout
+        self.max_holdout = max_holdout
+        self.batch_rows = batch_rows
+        self.seed = seed
+        self.device = device
+        self.scaler = None
+        self.shape = (0, len(self.feature_names))
+
+    def record_batches(self):
+        """Yield `(features, labels, in_holdout)` arrays for each record batch."""
+        columns = self.feature_names + [self.label]
+        for i, batch in enumerate(self.dataset.to_batches(columns=columns, batch_size=self.batch_rows)):
+            features = np.empty((batch.num_rows, len(self.feature_names)), dtype=np.float32)
+            for j in range(len(self.feature_names)):
+                features[:, j] = batch.column(j).to_numpy(zero_copy_only=False)
+            labels = batch.column(len(self.feature_names)).to_numpy(zero_copy_only=False)
+            in_holdout = np.random.default_rng([self.seed, i]).random(batch.num_rows) < self.holdout
+            yield features, labels, in_holdout
+
+    def fit(self):
+        """Fit the scaler and collect the held-out normal rows and the fraud rows."""
+        keep = min(1.0, self.max_holdout / max(1.0, self.holdout * self.dataset.count_rows()))
+        rng = np.random.default_rng(self.seed)
+        scaler, train_rows, holdout, fraud = MinMaxScaler(), 0, [], []
+        for features, labels, in_holdout in self.record_batches():
+            normal = labels == 0
+            train = features[normal & ~in_holdout]
+            if len(train):
+                scaler.partial_fit(train)
+                train_rows += len(train)
+            held = features[normal & in_holdout]
+            holdout.append(held[rng.random(len(held)) < keep])
+            fraud.append(features[~normal])
+        self.scaler = scaler
+        self.shape = (train_rows, len(self.feature_names))
+        self.holdout_rows = np.concatenate(holdout)[:self.max_holdout]
+        self.fraud_rows = np.concatenate(fraud)
+        return self
+
+    def minibatches(self, batch_size, shuffle=False):
+        pending = None
+        for features, labels, in_holdout in self.record_batches():
+            rows = features[(labels == 0) & ~in_holdout]
+            if not len(rows):
+                continue
+            rows = self.scaler.transform(rows)
+            rows = torch.from_numpy(rows.astype(np.float32, copy=False))
+            if pending is not None:
+                rows = torch.cat([pending, rows])
+            whole = len(rows) - len(rows) % batch_size
+            for batch in iterate_minibatches(rows[:whole].to(self.device), batch_size, shuffle):
+                yield batch
+            pending = rows[whole:]
+        if pending is not None and len(pending):
+            yield pending.to(self.device)
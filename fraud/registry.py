@@ -0,0 +1,90 @@
+"""Several named model versions hosted in one scoring process.
+
+`ModelRegistry.get(name)` returns the scorer for the version directory
+`<root>/<name>` (as published by `fraud.reload.publish_version`), loading it
+on first use. All versions share the process and its imported runtime, so an
+extra version only costs its own weights. Loaded versions are kept in least
+recently used order, and the oldest ones are evicted once their estimated
+size goes over `memory_budget` bytes. The version being loaded is never
+evicted.
+
+A name can be republished, so at most every `check_interval` seconds a
+loaded version's `published_id` is compared with the one on disk, and the
+version is loaded again when they differ.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from fraud.reload import published_id
+
+class ModelRegistry(object):
+    def __init__(self, root, load_fn, memory_budget, check_interval=10.0):
+        self.root = root
+        self.load_fn = load_fn
+        self.memory_budget = memory_budget
+        self.check_interval = check_interval
+        self.loads = 0
+        self.evictions = 0
+        self._loaded = OrderedDict()
+        self._checked = {}
+        self._lock = threading.Lock()
+        self._loading = {}
+
+    def names(self):
+        return sorted(name for name in os.listdir(self.root)
+                      if not name.startswith('.') and not name.endswith('.tmp')
+                      and os.path.isdir(os.path.join(self.root, name)))
+
+    def _is_stale(self, name, scorer):
+        now = time.monotonic()
+        if now - self._checked.get(name, now) < self.check_interval:
+            return False
+        self._checked[name] = now
+        on_disk = published_id(os.path.join(self.root, name))
+        return on_disk is not None and on_disk != getattr(scorer, 'published_id', None)
+
+    def get(self, name):
+        with self._lock:
+            scorer = self._loaded.get(name)
+            if scorer is not None:
+                if not self._is_stale(name, scorer):
+                    self._loaded.move_to_end(name)
+                    return scorer
+                del self._loaded[name]
+            lock = self._loading.setdefault(name, threading.Lock())
+        with lock:
+            with self._lock:
+                scorer = self._loaded.get(name)
+            if scorer is None:
+                if name not in self.names():
+                    raise KeyError('Unknown model version: {}'.format(name))
+                scorer = self.load_fn(os.path.join(self.root, name))
+                with self._lock:
+                    self._loaded[name] = scorer
+                    self._checked[name] = time.monotonic()
+                    self.loads += 1
+                    self._evict(keep=name)
+        return scorer
+
+    def _evict(self, keep):
+        while self.loaded_bytes() > self.memory_budget and len(self._loaded) > 1:
+            name = next(iter(self._loaded))
+            if name == keep:
+                self._loaded.move_to_end(name)
+                name = next(iter(self._loaded))
+            del self._loaded[name]
+            self.evictions += 1
+
+    def loaded_bytes(self):
+        return sum(scorer.nbytes() for scorer in self._loaded.values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                'loaded': list(self._loaded),
+                'loaded_bytes': self.loaded_bytes(),
+                'memory_budget': self.memory_budget,
+                'loads': self.loads,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,156 @@
+"""Versioned model artifacts and hot reload for the scoring process.
+
+Every training run publishes its artifacts to a new directory under the
+versions root together with a `meta.json` holding the split point, and then
+points the `CURRENT` file at it. Each publish is written to its own hidden
+build directory (`model/versions/.<version>.<published_id>/`), and the
+version's name (`model/versions/<version>`) is a symlink to the build. The
+symlink and the pointer are both switched with a single atomic rename, so a
+reader never sees a half-written version, and a republished name never goes
+missing while it is replaced.
+
+`prune_versions` keeps only the most recently published versions (and always
+the current one). A build replaced by a republish is kept until the next
+publish, so a reader that resolved the old symlink can finish loading from it.
+
+`ModelReloader` polls `CURRENT` in a background thread, loads a new version
+completely off the request path, and only then replaces its `active` scorer.
+A request that picked up the old scorer finishes on it, and a version that
+fails to load is logged once and skipped while the old one keeps serving.
+
+A version name can be published again (e.g. a retrain under the same
+`TRAIN_VERSION_NAME`), so every publish also writes a unique `published_id`
+to `meta.json`. The reloader and `fraud.registry` compare that id, not the
+name, to tell whether they already hold the latest artifacts.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime
+
+def publish_version(paths, root, meta, version=None, keep=None):
+    """Copy the artifact files in `paths` to a new version under `root` and make it current.
+
+    With `keep`, only that many of the most recently published versions are kept.
+    """
+    version = version or datetime.now().strftime('%Y%m%d%H%M%S')
+    publish = uuid.uuid4().hex
+    build = '.{}.{}'.format(version, publish)
+    staging = os.path.join(root, build + '.tmp')
+    os.makedirs(staging)
+    for path in paths:
+        shutil.copy2(path, staging)
+    with open(os.path.join(staging, 'meta.json'), 'w') as f:
+        json.dump(dict(meta, version=version, published_id=publish), f, indent=2)
+    os.rename(staging, os.path.join(root, build))
+    target = os.path.join(root, version)
+    replaced = os.readlink(target) if os.path.islink(target) else None
+    if os.path.isdir(target) and replaced is None:
+        # a version published as a plain directory: move it to a build of its own first
+        replaced = '.{}.{}'.format(version, published_id(target) or 'old')
+        os.rename(target, os.path.join(root, replaced))
+    link = os.path.join(root, build + '.link.tmp')
+    os.symlink(build, link)
+    os.replace(link, target)
+    set_current_version(root, version)
+    prune_versions(root, keep, spare=[replaced])
+    return version
+
+def _published_at(path):
+    return os.lstat(path).st_mtime
+
+def prune_versions(root, keep=None, spare=()):
+    """Remove all but the `keep` most recently published versions, and unused builds.
+
+    The current version is always kept, and so are the builds named in `spare`.
+    """
+    entries = [name for name in os.listdir(root) if name != 'CURRENT' and not name.endswith('.tmp')]
+    versions = sorted((name for name in entries if not name.startswith('.')),
+                      key=lambda name: _published_at(os.path.join(root, name)), reverse=True)
+    if keep is not None:
+        current = current_version(root)
+        for name in versions[keep:]:
+            path = os.path.join(root, name)
+            if name == current:
+                continue
+            if os.path.islink(path):
+                os.remove(path)
+            else:
+                shutil.rmtree(path, ignore_errors=True)
+    in_use = set(spare)
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if os.path.islink(path):
+            in_use.add(os.readlink(path))
+    for name in entries:
+        if name.startswith('.') and name not in in_use:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+def set_current_version(root, version):
+    pointer = os.path.join(root, 'CURRENT')
+    with open(pointer + '.tmp', 'w') as f:
+        f.write(version + '\n')
+    os.replace(pointer + '.tmp', pointer)
+
+def current_version(root):
+    try:
+        with open(os.path.join(root, 'CURRENT')) as f:
+            return f.read().strip() or None
+    except IOError:
+        return None
+
+def published_id(version_dir):
+    """The `published_id` in the `meta.json` of `version_dir`, or None if unreadable."""
+    try:
+        with open(os.path.join(version_dir, 'meta.json')) as f:
+            return json.load(f).get('published_id')
+    except (IOError, ValueError):
+        return None
+
+class ModelReloader(object):
+    def __init__(self, root, load_fn, interval=10.0, active=None):
+        self.root = root
+        self.load_fn = load_fn
+        self.interval = interval
+        self.reloads = 0
+        self.failures = 0
+        if active is None:
+            active = load_fn(os.path.join(root, current_version(root)))
+        self.active = active
+        self._failed_version = None
+        self._thread = None
+
+    def check(self):
+        """Load and activate the current version if it differs from the active one."""
+        version = current_version(self.root)
+        if version is None:
+            return False
+        publish = (version, published_id(os.path.join(self.root, version)))
+        if publish in ((self.active.version, getattr(self.active, 'published_id', None)), self._failed_version):
+            return False
+        try:
+            scorer = self.load_fn(os.path.join(self.root, version))
+        except Exception:
+            self._failed_version = publish
+            self.failures += 1
+            print('Failed to load model version {}, still serving {}'.format(version, self.active.version))
+            traceback.print_exc()
+            return False
+        self.active = scorer
+        self.reloads += 1
+        print('Now serving model version {}'.format(version))
+        return True
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.check()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='model-reloader', daemon=True)
+        self._thread.start()
+        return self
@@ -0,0 +1,128 @@
+"""Loading the fraud autoencoder for scoring.
+
+`load_scorer` imports only what the chosen engine needs, so the NumPy engine
+never pulls in torch or sklearn, and records how long the imports and the
+artifact loading took in `timings`. `warm_up` runs synthetic rows through a
+loaded scorer so the first real request does not pay for lazy initialisation
+inside torch and NumPy.
+"""
+import hashlib
+import json
+import os
+import time
+import numpy as np
+from fraud.metrics import NULL_METRICS
+
+def artifact_version(paths):
+    """Return a short content hash identifying the model artifacts at `paths`."""
+    digest = hashlib.blake2b(digest_size=6)
+    for path in paths:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+class TorchScorer(object):
+    engine = 'torch'
+
+    def __init__(self, torch, model, scaler, model_bytes=None):
+        self._torch = torch
+        self.model = model
+        self.scaler = scaler
+        self.model_bytes = model_bytes
+        self.metrics = NULL_METRICS
+
+    def nbytes(self):
+        # Frozen and quantized TorchScript modules keep their weights out of `state_dict`,
+        # so those scorers are sized by their serialized file instead.
+        if self.model_bytes is None:
+            tensors = list(self.model.state_dict().values())
+            model_bytes = sum(t.numel() * t.element_size() for t in tensors if hasattr(t, 'numel'))
+        else:
+            model_bytes = self.model_bytes
+        return (model_bytes
+                + sum(getattr(self.scaler, a).nbytes for a in ('scale_', 'min_', 'data_min_', 'data_max_', 'data_range_')))
+
+    def score(self, rows):
+        """Return the log reconstruction error for each row of raw feature values."""
+        torch, metrics = self._torch, self.metrics
+        with torch.no_grad():
+            with metrics.stage('scale'):
+                inp=self.scaler.transform(np.asarray(rows, dtype=np.float64))
+            with metrics.stage('tensor'):
+                inp=torch.tensor(inp, dtype=torch.float32)
+            with metrics.stage('forward'):
+                outp=self.model(inp)
+                return torch.sum((inp-outp)**2,dim=1).sqrt().log().numpy()
+
+def load_scorer(engine='torch', model_dir='model', num_features=29, split_point=None, timings=None):
+    """Load the model in `model_dir` for `engine`.
+
+    The scorer carries the `version` and `split_point` it should be used with. When
+    `model_dir` holds a `meta.json` (a published version), both come from there. A
+    bundle carries its own. Otherwise the version is a content hash of the artifacts
+    and `split_point` is the one passed in. `published_id` tells apart two publishes
+    under the same version name.
+    """
+    timings = {} if timings is None else timings
+    start = time.perf_counter()
+    if engine == 'numpy':
+        from fraud.numpy_engine import NumpyAutoencoder
+        timings['import'] = time.perf_counter() - start
+        start = time.perf_counter()
+        paths = [os.path.join(model_dir, 'creditcard-fraud.npz')]
+        scorer = NumpyAutoencoder.load(paths[0])
+    elif engine == 'bundle':
+        from fraud.bundle import load_bundle_scorer
+        timings['import'] = time.perf_counter() - start
+        start = time.perf_counter()
+        paths = [os.path.join(model_dir, 'creditcard-fraud.bundle')]
+        scorer = load_bundle_scorer(paths[0])
+        split_point = scorer.split_point
+    elif engine == 'torch':
+        import torch
+        import joblib
+        from fraud.autoencoder import autoencoder
+        timings['import'] = time.perf_counter() - start
+        start = time.perf_counter()
+        paths = [os.path.join(model_dir, 'creditcard-fraud.model'), os.path.join(model_dir, 'cc_scaler.pkl')]
+        scaler = joblib.load(paths[1])
+        model = autoencoder(num_features)
+        model.load_state_dict(torch.load(paths[0]))
+        model.eval()
+        scorer = TorchScorer(torch, model, scaler)
+    elif engine in ('torchscript', 'int8'):
+        import torch
+        import joblib
+        from fraud.variants import VARIANT_FILES
+        timings['import'] = time.perf_counter() - start
+        start = time.perf_counter()
+        paths = [os.path.join(model_dir, VARIANT_FILES[engine]), os.path.join(model_dir, 'cc_scaler.pkl')]
+        if not os.path.exists(paths[0]):
+            raise FileNotFoundError('{} not found: run 3_model_train.py, or python -m fraud.variants, '
+                                    'to build the {} model'.format(paths[0], engine))
+        scaler = joblib.load(paths[1])
+        model = torch.jit.load(paths[0])
+        model.eval()
+        scorer = TorchScorer(torch, model, scaler, model_bytes=os.path.getsize(paths[0]))
+        scorer.engine = engine
+    else:
+        raise ValueError('Unknown scoring engine: {}'.format(engine))
+    meta_path = os.path.join(model_dir, 'meta.json')
+    meta = {}
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+    scorer.version = meta.get('version') or getattr(scorer, 'version', None) or artifact_version(paths)
+    scorer.split_point = meta.get('split_point', split_point)
+    scorer.published_id = meta.get('published_id')
+    timings['load'] = time.perf_counter() - start
+    return scorer
+
+def warm_up(scorer, num_features=29, batch_size=64, timings=None):
+    timings = {} if timings is None else timings
+    start = time.perf_counter()
+    rows = np.zeros((batch_size, num_features))
+    scorer.score(rows[:1])
+    scorer.score(rows)
+    timings['warmup'] = time.perf_counter() - start
+    return timings
@@ -0,0 +1,166 @@
+"""A local HTTP stand-in for the CML Model service.
+
+It serves the functions of a model script (`99_model.py` by default) with the
+same request and response envelope as the CML model endpoint:
+
+    POST /model                 {"accessKey": "...", "request": {...}} -> predict
+    POST /model/<function>      same envelope, calls e.g. predict_batch
+    GET  /metrics               Prometheus text from the script's `metrics_text`
+    GET  /status                the script's `status`
+
+Only the functions in `ENDPOINTS` are served. The script's other functions
+(loading versions, scoring helpers) are not reachable over HTTP.
+
+This lets the benchmark and local load tests run against the scorer over HTTP
+without deploying it. Run it with `python -m fraud.server --port 8080`.
+
+With `--workers N` the model is loaded once and N worker processes are forked
+from it, all accepting on the same listening socket. The weights and scaler
+parameters are read-only after loading, so the workers share their pages
+copy-on-write (`gc.freeze` keeps the garbage collector from touching them),
+and each worker limits torch to `--threads-per-worker` intra-op threads. One
+larger container can then use all of its cores, at the memory cost of one
+copy of the model plus a small per-worker overhead. Each worker keeps its own
+metrics.
+"""
+import argparse
+import gc
+import importlib.util
+import json
+import os
+import signal
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENDPOINTS = ('predict', 'predict_batch', 'status', 'metrics_text')
+
+def load_model_script(path='99_model.py', name='fraud_model'):
+    """Import a model script (whose file name is not a valid module name) as a module."""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def make_handler(model):
+    class ModelHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def _send(self, status, body, content_type='application/json'):
+            data = body.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            parts = self.path.strip('/').split('/')
+            function = parts[1] if len(parts) > 1 else 'predict'
+            length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(length)
+            if parts[0] != 'model' or len(parts) > 2 or function not in ENDPOINTS \
+                    or not callable(getattr(model, function, None)):
+                return self._send(404, json.dumps({'success': False, 'error': 'unknown function'}))
+            try:
+                envelope = json.loads(body)
+                response = getattr(model, function)(envelope['request'])
+            except Exception as e:
+                return self._send(400, json.dumps({'success': False, 'error': repr(e)}))
+            self._send_json({'success': True, 'response': response})
+
+        def _send_json(self, body):
+            try:
+                data = json.dumps(body, default=float)
+            except (TypeError, ValueError) as e:
+                return self._send(500, json.dumps({'success': False, 'error': 'unserializable response: ' + repr(e)}))
+            self._send(200, data)
+
+        def do_GET(self):
+            if self.path == '/metrics' and hasattr(model, 'metrics_text'):
+                return self._send(200, model.metrics_text({})['prometheus'], 'text/plain; version=0.0.4')
+            if self.path == '/status' and hasattr(model, 'status'):
+                return self._send_json(model.status({}))
+            self._send(404, json.dumps({'success': False, 'error': 'not found'}))
+
+        def log_message(self, format, *args):
+            pass
+
+    return ModelHandler
+
+def make_server(model, host='127.0.0.1', port=8080):
+    server = ThreadingHTTPServer((host, port), make_handler(model))
+    server.daemon_threads = True
+    return server
+
+def _limit_torch_threads(threads):
+    torch = sys.modules.get('torch')
+    if torch is not None:
+        torch.set_num_threads(threads)
+
+def _run_worker(model, server, threads):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    _limit_torch_threads(threads)
+    if hasattr(model, 'after_fork'):
+        model.after_fork()
+    server.serve_forever()
+
+def serve_prefork(script, host, port, workers, threads=1):
+    """Load `script` once, then serve it from `workers` forked processes until terminated."""
+    for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS'):
+        os.environ.setdefault(var, str(threads))
+    model = load_model_script(script)
+    server = make_server(model, host, port)
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+    children = set()
+    stopping = []
+
+    def spawn():
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _run_worker(model, server, threads)
+            finally:
+                os._exit(1)
+        children.add(pid)
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+    print('Serving {} on http://{}:{}/model with {} workers'.format(script, host, server.server_address[1], workers))
+    while children:
+        try:
+            pid, status = os.wait()
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            print('Worker {} exited with status {}, starting a new one'.format(pid, status))
+            spawn()
+    server.server_close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--script', default='99_model.py')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=int(os.getenv('CDSW_APP_PORT', '8080')))
+    parser.add_argument('--workers', type=int, default=1, help='number of pre-forked worker processes')
+    parser.add_argument('--threads-per-worker', type=int, default=1, help='torch intra-op threads per worker')
+    args = parser.parse_args(argv)
+    if args.workers > 1:
+        return serve_prefork(args.script, args.host, args.port, args.workers, args.threads_per_worker)
+    server = make_server(load_model_script(args.script), args.host, args.port)
+    print('Serving {} on http://{}:{}/model'.format(args.script, args.host, args.port))
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Shadow scoring of a candidate model next to the production one.
+
+The request path only hands what it has already scored to `offer`, which
+never blocks: when the bounded queue is full the rows are dropped and
+counted instead. A background thread drains the queue in batches, scores
+them with the candidate, and appends to a JSON lines log
+
+* one `{"t", "n", "disagree", "mean_delta", "max_abs_delta"}` summary per
+  batch, where delta is candidate score minus primary score, and
+* one `{"t", "id", "primary", "candidate", "flag"}` line per disagreement,
+  `flag` being the candidate's result.
+"""
+import json
+import queue
+import threading
+import time
+import numpy as np
+
+class ShadowScorer(object):
+    def __init__(self, candidate, log_path, max_queue=10000, batch_size=256, max_wait=0.05):
+        self.candidate = candidate
+        self.log_path = log_path
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.scored = 0
+        self.dropped = 0
+        self.disagreements = 0
+        self.start()
+
+    def start(self):
+        """Start the shadow thread, or restart it in a forked worker process."""
+        self._queue = queue.Queue(self.max_queue)
+        self._thread = threading.Thread(target=self._run, name='shadow-scorer', daemon=True)
+        self._thread.start()
+
+    def offer(self, ids, rows, scores, flags):
+        """Queue primary results for shadow scoring, dropping them if the shadow is behind."""
+        try:
+            self._queue.put_nowait((ids, rows, scores, flags))
+        except queue.Full:
+            self.dropped += len(ids)
+
+    def _collect(self):
+        items = [self._queue.get()]
+        rows = len(items[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while rows < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+            rows += len(items[-1][0])
+        return items
+
+    def _run(self):
+        with open(self.log_path, 'a') as log:
+            while True:
+                items = self._collect()
+                try:
+                    self._compare(items, log)
+                except Exception as e:
+                    log.write(json.dumps({'t': round(time.time(), 3), 'error': repr(e)}) + '\n')
+                log.flush()
+
+    def _compare(self, items, log):
+        ids = [i for item in items for i in item[0]]
+        rows = np.asarray([r for item in items for r in item[1]], dtype=np.float64)
+        primary = np.asarray([s for item in items for s in item[2]], dtype=np.float64)
+        flags = np.asarray([f for item in items for f in item[3]], dtype=bool)
+        candidate = self.candidate.score(rows)
+        candidate_flags = candidate > self.candidate.split_point
+        delta = candidate - primary
+        disagree = np.flatnonzero(candidate_flags != flags)
+        now = round(time.time(), 3)
+        self.scored += len(ids)
+        self.disagreements += len(disagree)
+        log.write(json.dumps({'t': now, 'n': len(ids), 'disagree': len(disagree),
+                              'mean_delta': float(delta.mean()),
+                              'max_abs_delta': float(np.abs(delta).max())}) + '\n')
+        for i in disagree:
+            log.write(json.dumps({'t': now, 'id': ids[i], 'primary': round(float(primary[i]), 5),
+                                  'candidate': round(float(candidate[i]), 5),
+                                  'flag': bool(candidate_flags[i])}, default=int) + '\n')
+
+    def stats(self):
+        return {
+            'version': self.candidate.version,
+            'scored': self.scored,
+            'dropped': self.dropped,
+            'disagreements': self.disagreements,
+            'queued': self._queue.qsize(),
+        }
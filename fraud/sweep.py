@@ -0,0 +1,106 @@
+"""Local hyperparameter sweep for the fraud autoencoder.
+
+A search space maps each hyperparameter (`batch_size`, `lr`, `num_epochs`)
+to either a list of values or a range `{"low": .., "high": .., "log": true}`.
+`grid_configs` takes the cartesian product of the lists. `random_configs`
+draws each value from its list or range.
+
+`run_sweep` trains the configurations concurrently in a fork-based process
+pool. The scaled arrays are published as module globals before the pool
+forks, so every worker reads the parent's copy instead of unpickling its
+own. Each worker caps torch at `threads` intra-op threads so that the
+workers together do not oversubscribe the cores.
+"""
+import itertools
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import torch
+from fraud.training import train_autoencoder, EarlyStopping
+from fraud.threshold import best_split_point
+from fraud.variants import log_scores
+
+HYPERPARAMETERS = ('batch_size', 'lr', 'num_epochs')
+
+_train_set = None
+_normal_set = None
+_fraud_set = None
+
+def grid_configs(space):
+    for name, values in space.items():
+        if not isinstance(values, list):
+            raise ValueError('grid search needs a list of values for {}'.format(name))
+    names = list(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space[n] for n in names))]
+
+def _draw(values, rng):
+    if isinstance(values, list):
+        return rng.choice(values)
+    low, high = values['low'], values['high']
+    if values.get('log'):
+        value = float(np.exp(rng.uniform(np.log(low), np.log(high))))
+    else:
+        value = rng.uniform(low, high)
+    return int(round(value)) if isinstance(low, int) and isinstance(high, int) else value
+
+def random_configs(space, trials, seed=0):
+    rng = random.Random(seed)
+    return [{name: _draw(values, rng) for name, values in space.items()} for _ in range(trials)]
+
+def _init_worker(threads):
+    torch.set_num_threads(threads)
+
+def run_trial(config, seed=0, patience=None):
+    """Train and evaluate one configuration on the shared arrays.
+
+    With `patience`, the normal held-out rows also drive early stopping.
+    """
+    torch.manual_seed(seed)
+    start = time.perf_counter()
+    inputs = torch.tensor(_train_set, dtype=torch.float32)
+    normal = torch.tensor(_normal_set, dtype=torch.float32)
+    early_stopping = EarlyStopping(patience) if patience is not None else None
+    model, throughput = train_autoencoder(inputs, config['batch_size'], config['lr'],
+                                          config['num_epochs'], log_every=0,
+                                          validation=normal if early_stopping else None,
+                                          early_stopping=early_stopping)
+    loss1 = log_scores(model, normal)
+    loss2 = log_scores(model, torch.tensor(_fraud_set, dtype=torch.float32))
+    split_point, precision = best_split_point(loss1, loss2)
+    return dict(config,
+                precision=precision,
+                split_point=split_point,
+                best_epoch=early_stopping.best_epoch if early_stopping else config['num_epochs'],
+                wall_s=time.perf_counter() - start,
+                samples_per_sec=throughput.samples_per_sec,
+                pid=os.getpid())
+
+def run_sweep(configs, train_set, normal_set, fraud_set, workers=None, threads=None, patience=None):
+    """Train `configs` in parallel, best first by precision then wall time.
+
+    `normal_set` and `fraud_set` are the scaled held-out rows used to find
+    each trial's split point. `threads` defaults to the cores divided
+    evenly between the `workers`. `patience` turns on early stopping.
+    """
+    global _train_set, _normal_set, _fraud_set
+    workers = min(workers or os.cpu_count() or 1, len(configs))
+    threads = threads or max(1, (os.cpu_count() or 1) // workers)
+    _train_set, _normal_set, _fraud_set = train_set, normal_set, fraud_set
+    results = []
+    try:
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'),
+                                 initializer=_init_worker, initargs=(threads,)) as pool:
+            futures = {pool.submit(run_trial, config, seed, patience): config
+                       for seed, config in enumerate(configs)}
+            for future in as_completed(futures):
+                result = future.result()
+                print('trial {} precision {:.4f} split point {:.3f} in {:.1f}s'.format(
+                      {k: result[k] for k in futures[future]}, result['precision'],
+                      result['split_point'], result['wall_s']))
+                results.append(result)
+    finally:
+        _train_set = _normal_set = _fraud_set = None
+    return sorted(results, key=lambda r: (-r['precision'], r['wall_s']))
@@ -0,0 +1,68 @@
+"""Exact split point selection from normal and fraud scores.
+
+A row is flagged as fraud when its score is above the split point, so
+normal precision is the share of normal scores below the split point, and
+fraud precision is the share of fraud scores above it.
+
+`best_split_point` sorts all scores once. The cumulative count of normal
+scores at each position is the normal precision for a cut just above it,
+and the remaining fraud count gives the fraud precision. The maximum
+balanced precision is then an argmax over every distinct cut, not a search
+that can settle on a local optimum. Among equally good cuts it takes the
+one with the widest gap to its neighbours, and it puts the split point in
+the middle of that gap.
+
+`split_point_at_fpr` gives the operating point for a false-positive budget:
+a split point that flags at most `target_fpr` of the normal scores.
+"""
+import numpy as np
+
+def _as_array(scores):
+    if hasattr(scores, 'detach'):
+        scores = scores.detach().cpu().numpy()
+    return np.asarray(scores, dtype=np.float64).ravel()
+
+def best_split_point(normal_scores, fraud_scores):
+    """Return `(split_point, precision)` maximising balanced precision."""
+    normal, fraud = _as_array(normal_scores), _as_array(fraud_scores)
+    scores = np.concatenate([normal, fraud])
+    order = np.argsort(scores, kind='mergesort')
+    scores = scores[order]
+    is_normal = order < len(normal)
+
+    # Cut i lies between scores[i-1] and scores[i]: i = 0 is below everything and
+    # i = len(scores) above everything. Only cuts between distinct scores are reachable.
+    normal_below = np.concatenate([[0], np.cumsum(is_normal)])
+    fraud_below = np.concatenate([[0], np.cumsum(~is_normal)])
+    precision = (normal_below / len(normal) + (len(fraud) - fraud_below) / len(fraud)) / 2
+    reachable = np.concatenate([[True], scores[1:] > scores[:-1], [True]])
+    precision = np.where(reachable, precision, -1.0)
+
+    lower = np.concatenate([[scores[0] - 1.0], scores])
+    upper = np.concatenate([scores, [scores[-1] + 1.0]])
+    best = np.flatnonzero(precision == precision.max())
+    i = best[np.argmax(upper[best] - lower[best])]
+    return float((lower[i] + upper[i]) / 2), float(precision[i])
+
+def split_point_at_fpr(normal_scores, target_fpr):
+    """Split point with at most `target_fpr` of `normal_scores` above it."""
+    normal = np.sort(_as_array(normal_scores))
+    allowed = int(np.floor(target_fpr * len(normal)))
+    if allowed >= len(normal):
+        return float(normal[0] - 1.0)
+    # Halfway from the highest unflagged score to the next distinct score up, so
+    # no normal score sits on the split point.
+    kept = normal[len(normal) - allowed - 1]
+    j = np.searchsorted(normal, kept, side='right')
+    if j == len(normal):
+        return float(np.nextafter(np.float32(kept), np.float32(np.inf)))
+    return float((kept + normal[j]) / 2)
+
+def operating_point(normal_scores, fraud_scores, split_point):
+    """False-positive rate and precisions at `split_point`."""
+    normal, fraud = _as_array(normal_scores), _as_array(fraud_scores)
+    fpr = float((normal > split_point).mean())
+    recall = float((fraud > split_point).mean())
+    return {'split_point': float(split_point), 'fpr': fpr,
+            'precision_normal': 1 - fpr, 'precision_fraud': recall,
+            'precision': (1 - fpr + recall) / 2}
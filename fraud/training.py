@@ -0,0 +1,161 @@
+"""Training helpers for the fraud autoencoder.
+
+The whole training set is a single in-memory float32 tensor, so
+`iterate_minibatches` just slices contiguous views out of it. That avoids
+`DataLoader` worker processes and per-row collation. With `shuffle` it
+applies one random permutation per epoch and then slices the shuffled copy.
+
+`train_autoencoder` is the training loop used by `3_model_train.py` and by
+the hyperparameter sweep in `fraud.sweep`. Given a validation tensor it
+measures the validation loss after every epoch. `EarlyStopping` keeps a
+copy of the best weights, restores them at the end, and ends training once
+the loss has not improved for `patience` epochs.
+
+For warm-start retraining, `init_state` continues from an existing model.
+`scaler_drift` decides whether the saved scaler still covers the new rows.
+"""
+import time
+from datetime import datetime
+import numpy as np
+import torch
+import torch.nn as nn
+from fraud.autoencoder import autoencoder
+
+def iterate_minibatches(inputs, batch_size, shuffle=False, generator=None):
+    if shuffle:
+        inputs = inputs[torch.randperm(len(inputs), generator=generator, device=inputs.device)]
+    for start in range(0, len(inputs), batch_size):
+        yield inputs[start:start + batch_size]
+
+class Throughput(object):
+    """Samples per second over the epochs timed so far."""
+
+    def __init__(self):
+        self.samples = 0
+        self.seconds = 0.0
+
+    def epoch(self, samples, seconds):
+        self.samples += samples
+        self.seconds += seconds
+        return samples / seconds if seconds else 0.0
+
+    @property
+    def samples_per_sec(self):
+        return self.samples / self.seconds if self.seconds else 0.0
+
+    @staticmethod
+    def now():
+        return time.perf_counter()
+
+class EarlyStopping(object):
+    """Best-checkpoint tracking on the validation loss, with patience.
+
+    `patience=0` never stops early but still keeps the best weights.
+    """
+
+    def __init__(self, patience=10, min_delta=0.0):
+        self.patience = patience
+        self.min_delta = min_delta
+        self.best_loss = float('inf')
+        self.best_epoch = 0
+        self.epochs = 0
+        self.best_state = None
+
+    def step(self, val_loss, model):
+        """Record one epoch's validation loss; True when training should stop."""
+        self.epochs += 1
+        if val_loss < self.best_loss - self.min_delta:
+            self.best_loss = val_loss
+            self.best_epoch = self.epochs
+            self.best_state = {k: v.detach().clone() for k, v in model.state_dict().items()}
+        return bool(self.patience) and self.epochs - self.best_epoch >= self.patience
+
+    def restore(self, model):
+        if self.best_state is not None:
+            model.load_state_dict(self.best_state)
+        return model
+
+def validation_loss(model, inputs, batch_size=65536):
+    """Mean squared reconstruction error per feature over `inputs`."""
+    model.eval()
+    total = torch.zeros((), device=inputs.device)
+    with torch.no_grad():
+        for batch in iterate_minibatches(inputs, batch_size):
+            total += torch.sum((model(batch) - batch)**2)
+    return total.item() / inputs.numel()
+
+def scaler_drift(scaler, rows):
+    """How far `rows` fall outside the fitted range of a `MinMaxScaler`.
+
+    The result is the largest overshoot below `data_min_` or above
+    `data_max_` over all features, as a fraction of that feature's range.
+    0 means every row is inside the range the scaler was fitted on.
+    """
+    rows = np.asarray(rows, dtype=np.float64)
+    span = np.where(scaler.data_range_ > 0, scaler.data_range_, 1.0)
+    below = (scaler.data_min_ - rows.min(axis=0)) / span
+    above = (rows.max(axis=0) - scaler.data_max_) / span
+    return float(max(below.max(), above.max(), 0.0))
+
+def _minibatches(inputs, batch_size, shuffle):
+    if torch.is_tensor(inputs):
+        return iterate_minibatches(inputs, batch_size, shuffle)
+    return inputs.minibatches(batch_size, shuffle)
+
+def train_autoencoder(inputs, batch_size, lr, num_epochs, shuffle=False, log_every=5,
+                      validation=None, early_stopping=None, init_state=None):
+    """Train an autoencoder on `inputs`, on whatever device they live on.
+
+    `inputs` is a tensor, or a streaming source such as
+    `fraud.parquet_input.ParquetRows` with `shape`, `device` and a
+    `minibatches(batch_size, shuffle)` generator.
+
+    Training starts from random weights, or from the `init_state` state dict
+    to fine-tune an existing model. Returns the model and its `Throughput`.
+    Progress is printed every `log_every` epochs; pass 0 to train quietly.
+    With `validation` rows and an `EarlyStopping`, the returned model has the
+    best validation weights.
+    """
+    device = inputs.device
+    model = autoencoder(inputs.shape[1])
+    if init_state is not None:
+        model.load_state_dict(init_state)
+    criterion = nn.MSELoss(reduction='sum')
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr, weight_decay=1e-5)
+
+    model.to(device)
+    criterion.to(device)
+
+    throughput = Throughput()
+    for epoch in range(num_epochs):
+        model.train()
+        epoch_start = Throughput.now()
+        loss_sum=torch.zeros((), device=device)
+        rows=0
+        for inputs1 in _minibatches(inputs, batch_size, shuffle):
+            outputs = model(inputs1)
+            loss = criterion(outputs, inputs1)
+            loss_sum+=loss.detach()
+            rows+=len(inputs1)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+        num=rows*inputs.shape[1]
+        samples_per_sec = throughput.epoch(rows, Throughput.now() - epoch_start)
+
+        val_loss = validation_loss(model, validation) if validation is not None else None
+        stop = early_stopping is not None and val_loss is not None and early_stopping.step(val_loss, model)
+
+        if log_every and ((epoch+1)%log_every == 0 or stop):
+            print('{} epoch [{}/{}], loss:{:.6f}, {}{:.0f} samples/sec'
+                    .format(datetime.now(), epoch + 1, num_epochs, loss_sum.item()/num,
+                            '' if val_loss is None else 'val_loss:{:.6f}, '.format(val_loss), samples_per_sec))
+        if stop:
+            if log_every:
+                print('Stopping early: no improvement for {} epochs'.format(early_stopping.patience))
+            break
+
+    if early_stopping is not None:
+        early_stopping.restore(model)
+    model.eval()
+    return model, throughput
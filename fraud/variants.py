@@ -0,0 +1,92 @@
+"""TorchScript and int8 serving variants of the fraud autoencoder.
+
+`build_variants` turns a trained `autoencoder` into a traced and frozen
+TorchScript module, and a TorchScript module whose `nn.Linear` layers are
+dynamically quantized to int8. Both are saved with `torch.jit.save` next to
+`creditcard-fraud.model`, and 99_model.py loads them with `torch.jit.load`
+when `MODEL_ENGINE` is `torchscript` or `int8`. `compare_variants` reports
+how much each variant moves the precision at the training split point and
+how fast it is. `python -m fraud.variants` rebuilds both from the artifacts
+in model/.
+"""
+import time
+import torch
+import torch.nn as nn
+
+VARIANT_FILES = {
+    'torchscript': 'creditcard-fraud.torchscript.pt',
+    'int8': 'creditcard-fraud.int8.pt',
+}
+
+def _script(module, example):
+    traced = torch.jit.trace(module, example)
+    freeze = getattr(torch.jit, 'freeze', None)  # torch >= 1.8
+    return freeze(traced) if freeze is not None else traced
+
+def build_variants(model, example):
+    model = model.cpu().eval()
+    example = example.cpu()
+    quantized = torch.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    with torch.no_grad():
+        return {
+            'torchscript': _script(model, example),
+            'int8': _script(quantized, example),
+        }
+
+def save_variants(variants, model_dir='model'):
+    paths = []
+    for name, module in variants.items():
+        paths.append('{}/{}'.format(model_dir, VARIANT_FILES[name]))
+        torch.jit.save(module, paths[-1])
+    return paths
+
+def log_scores(model, inputs):
+    with torch.no_grad():
+        return torch.sum((inputs - model(inputs))**2, dim=1).sqrt().log()
+
+def seconds_per_call(model, inputs, repeat=200):
+    with torch.no_grad():
+        model(inputs)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            model(inputs)
+    return (time.perf_counter() - start) / repeat
+
+def compare_variants(models, normal_inputs, fraud_inputs, split_point):
+    """Return precision at `split_point` and latency for each model in `models`."""
+    normal_inputs, fraud_inputs = normal_inputs.cpu(), fraud_inputs.cpu()
+    report = {}
+    for name, model in models.items():
+        precision1 = (log_scores(model, normal_inputs) < split_point).float().mean().item()
+        precision2 = (log_scores(model, fraud_inputs) > split_point).float().mean().item()
+        report[name] = {
+            'precision_normal': precision1,
+            'precision_fraud': precision2,
+            'precision': (precision1 + precision2) / 2,
+            'latency_1_ms': seconds_per_call(model, fraud_inputs[:1]) * 1000,
+            'latency_256_ms': seconds_per_call(model, fraud_inputs[:256], repeat=50) * 1000,
+        }
+    return report
+
+if __name__ == '__main__':
+    # Build the variants from the separate artifacts in model/ and compare their scores with the fp32 model.
+    import joblib
+    import numpy as np
+    from fraud.autoencoder import autoencoder
+
+    scaler = joblib.load('model/cc_scaler.pkl')
+    model = autoencoder(scaler.n_features_in_)
+    model.load_state_dict(torch.load('model/creditcard-fraud.model'))
+    model.eval()
+
+    # random scaled rows over the range the scaler was fitted on
+    rng = np.random.RandomState(42)
+    inputs = torch.tensor(rng.rand(10000, scaler.n_features_in_), dtype=torch.float32)
+    variants = build_variants(model, inputs[:1])
+    print(save_variants(variants, 'model'))
+    expected = log_scores(model, inputs)
+    for name, module in variants.items():
+        diff = (log_scores(module, inputs) - expected).abs().max().item()
+        print('{:<12} max abs score difference vs fp32 {:.2e}  latency 1 row {:.3f}ms, 256 rows {:.3f}ms'.format(
+            name, diff, seconds_per_call(module, inputs[:1]) * 1000,
+            seconds_per_call(module, inputs[:256], repeat=50) * 1000))